@@ -0,0 +1,131 @@
+from gym import spaces
+import numpy as np
+
+from energy_environment import EnergyEnvironment
+
+
+class BatchEnergyEnvironment:
+    def __init__(self, num_rooms, seasons='winter'):
+        """
+        Vectorised version of EnergyEnvironment that steps N households per call.
+
+        Every household follows exactly the same dynamics and reward as a single EnergyEnvironment,
+        but the state, clock and appliance parameters are held as NumPy arrays so one call to `step`
+        advances the whole population by one hour.
+
+        Parameters:
+        - num_rooms: Sequence with the number of rooms for each household. Its length defines N.
+        - seasons: Either a single season ('winter' or 'summer') shared by all households, or a
+          sequence with one season per household.
+        """
+        self.num_rooms = np.asarray(num_rooms, dtype=float).reshape(-1)
+        self.num_envs = len(self.num_rooms)
+
+        if isinstance(seasons, str):
+            seasons = [seasons] * self.num_envs
+        self.seasons = np.asarray(seasons)
+        if self.seasons.shape != (self.num_envs,):
+            raise ValueError("seasons must be a single season or one season per household")
+
+        self.action_space = spaces.MultiDiscrete(np.full((self.num_envs, 5), 2))
+        self.observation_space = spaces.MultiDiscrete(np.full((self.num_envs, 5), 2))
+
+        self.state = np.zeros((self.num_envs, 5), dtype=np.int64)
+        self.current_hour = np.zeros(self.num_envs, dtype=np.int64)
+        self.current_day = np.zeros(self.num_envs, dtype=np.int64)
+
+        self.set_seasonal_parameters()
+        self.reset()
+
+    def set_seasonal_parameters(self):
+        """
+        Gather the per-household prices and appliance usage into (N,) arrays.
+
+        The values are read from a single-household EnergyEnvironment for each distinct season, so the
+        batched environment always agrees with the scalar one. Appliances that are missing in a season
+        (e.g. heating in summer) get a usage of 0.
+        """
+        appliances = ['washing_machine', 'fridge', 'lighting', 'heating', 'cooling', 'gas_heating', 'gas_cooking']
+        self.appliance_usage = {name: np.zeros(self.num_envs) for name in appliances}
+        self.peak_price = np.zeros(self.num_envs)
+        self.off_peak_price = np.zeros(self.num_envs)
+        self.gas_price = np.zeros(self.num_envs)
+
+        for season in np.unique(self.seasons):
+            env = EnergyEnvironment(season=season)
+            mask = self.seasons == season
+            for name in appliances:
+                self.appliance_usage[name][mask] = env.appliance_usage.get(name, 0)
+            self.peak_price[mask] = env.peak_price
+            self.off_peak_price[mask] = env.off_peak_price
+            self.gas_price[mask] = env.gas_price
+
+    def reset(self, mask=None):
+        """
+        Reset all households, or only those selected by a boolean mask of shape (N,).
+
+        Returns:
+        - The (N, 5) array of current states.
+        """
+        if mask is None:
+            mask = slice(None)
+        self.state[mask] = [0, 0, 1, 0, 0]
+        self.current_hour[mask] = 0
+        self.current_day[mask] = 0
+        return self.state.copy()
+
+    def step(self, actions):
+        """
+        Apply one action per household and advance every household by one hour.
+
+        Parameters:
+        - actions: Array of shape (N, 5) with the (light, washing_machine, fridge, gas_heating, gas_cooking)
+          switches of each household.
+
+        Returns:
+        - states: (N, 5) array of next states.
+        - rewards: (N,) array of rewards (negative cost in pounds).
+        - dones: (N,) boolean array, True once a household has simulated 90 days.
+        - info: Empty dict, kept for gym API compatibility.
+        """
+        actions = np.asarray(actions)
+        light = actions[:, 0]
+        washing_machine = actions[:, 1]
+        gas_heating = actions[:, 3]
+        gas_cooking = actions[:, 4]
+        usage = self.appliance_usage
+
+        # Same expression (and evaluation order) as EnergyEnvironment.step, with the fridge always on
+        electricity_used = (
+                light * 0.5 * self.num_rooms * usage['lighting'] +
+                washing_machine * 1.5 * usage['washing_machine'] +
+                1 * usage['fridge']
+        )
+        electricity_used += 2 * usage['heating']
+        electricity_used += 1 * usage['cooling']
+
+        gas_used = (
+                gas_heating * 3 * usage['gas_heating'] +
+                gas_cooking * 3 * usage['gas_cooking']
+        )
+
+        hour = self.current_hour
+        is_peak = ((7 <= hour) & (hour < 17)) | ((19 <= hour) & (hour < 23))
+        electricity_price = np.where(is_peak, self.peak_price / 100, self.off_peak_price / 100)
+
+        gas_price = self.gas_price / 100
+        rewards = -(electricity_used * electricity_price + gas_used * gas_price)
+
+        self.state[:] = actions
+        self.state[:, 2] = 1
+        self.current_hour += 1
+        rollover = self.current_hour >= 24
+        self.current_hour[rollover] = 0
+        self.current_day[rollover] += 1
+        dones = self.current_day >= 90
+
+        return self.state.copy(), rewards, dones, {}
+
+    def render(self, mode='human'):
+        for i in range(self.num_envs):
+            print(f"Household: {i}, Day: {self.current_day[i]}, Hour: {self.current_hour[i]}, State: {self.state[i]}")
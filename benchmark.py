@@ -0,0 +1,294 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+DEFAULT_BASELINE = 'data/benchmarks/baseline.json'
+
+
+class Benchmark:
+    def __init__(self, name, unit, setup, run, units):
+        """
+        One benchmark case.
+
+        Parameters:
+        - name: Unique name of the case, used as key in the baseline file.
+        - unit: What the throughput counts ('steps' or 'households').
+        - setup: Function returning the state passed to run. Not timed.
+        - run: Function taking the setup state and doing the measured work.
+        - units: Number of units of work done by one call of run.
+        """
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+        self.run = run
+        self.units = units
+
+    def measure(self, repeat):
+        """
+        Time the case `repeat` times (best time wins), then run it once more under tracemalloc for peak memory.
+
+        Returns:
+        - Dict with the unit, best time, throughput in units per second and peak traced memory in bytes.
+        """
+        times = []
+        for _ in range(repeat):
+            state = self.setup()
+            gc.collect()
+            start = time.perf_counter()
+            self.run(state)
+            times.append(time.perf_counter() - start)
+
+        state = self.setup()
+        gc.collect()
+        tracemalloc.start()
+        self.run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        best = min(times)
+        return {'unit': self.unit, 'units': self.units, 'seconds': best,
+                'throughput': self.units / best, 'peak_memory_bytes': peak}
+
+
+def _env_steps(steps, precompute=False, packed=False):
+    from encoding import encode
+    from energy_environment import EnergyEnvironment
+
+    def setup():
+        env = EnergyEnvironment(num_rooms=3, season='winter', precompute=precompute or packed)
+        env.reset()
+        actions = np.random.randint(0, 2, size=(steps, 5))
+        return env, encode(actions, [2, 2, 2, 2, 2]).tolist() if packed else actions.tolist()
+
+    def run(state):
+        env, actions = state
+        step = env.step_index if packed else env.step
+        for action in actions:
+            step(action)
+
+    return setup, run
+
+
+def _agent(steps, compact=False, method='choose_action'):
+    from q_learning_agent import QLearningAgent
+
+    def setup():
+        agent = QLearningAgent([2, 2, 2, 2, 2], [2, 2, 2, 2, 2], compact=compact)
+        states = np.random.randint(0, 2, size=(steps + 1, 5))
+        actions = np.random.randint(0, 2, size=(steps, 5))
+        rewards = -np.random.rand(steps)
+        return agent, states, actions, rewards
+
+    def run(state):
+        agent, states, actions, rewards = state
+        if method == 'choose_action':
+            for i in range(steps):
+                agent.choose_action(states[i])
+        elif method == 'choose_actions':
+            agent.choose_actions(states[:steps])
+        elif method == 'learn_batch':
+            agent.learn_batch(states[:steps], actions, rewards, states[1:])
+        else:
+            for i in range(steps):
+                agent.learn(states[i], actions[i], rewards[i], states[i + 1])
+
+    return setup, run
+
+
+def _replay(steps, prioritized=False, batch_size=64):
+    from q_learning_agent import QLearningAgent
+    from replay import ReplayBuffer
+
+    def setup():
+        agent = QLearningAgent([2, 2, 2, 2, 2], [2, 2, 2, 2, 2], compact=True)
+        buffer = ReplayBuffer(steps, agent.num_states, agent.num_actions, batch_size=batch_size,
+                              prioritized=prioritized, seed=0)
+        buffer.add_batch(np.random.randint(0, 32, steps), np.random.randint(0, 32, steps), -np.random.rand(steps),
+                         np.random.randint(0, 32, steps))
+        return agent, buffer
+
+    def run(state):
+        agent, buffer = state
+        for _ in range(steps // batch_size):
+            buffer.replay(agent)
+
+    return setup, run
+
+
+def _energy_model(method, compact=False):
+    from main import EnergyModel
+
+    def setup():
+        return EnergyModel(0, 3, 'winter', compact=compact)
+
+    def run(model):
+        if method == 'train_agent':
+            model.train_agent(episodes=1)
+        else:
+            getattr(model, method)()
+
+    return setup, run
+
+
+def _household_model(num_households, phase, columnar=False):
+    # Imported here rather than in the timed code, so the first case does not pay for importing mesa
+    if columnar:
+        from models.population import HouseholdPopulation
+
+        def build():
+            return HouseholdPopulation(num_households, 'winter', seed=0)
+    else:
+        from models.model import HouseholdEnergyModel
+
+        def build():
+            return HouseholdEnergyModel(num_households, 'winter')
+
+    def setup():
+        return None if phase == 'construct' else build()
+
+    def run(model):
+        if phase == 'construct':
+            build()
+        elif phase == 'step':
+            model.step()
+        else:
+            model.collect_data()
+
+    return setup, run
+
+
+def build_benchmarks(quick=False):
+    """
+    Return the list of benchmark cases. quick=True uses smaller sizes for a fast smoke run.
+    """
+    steps = 2000 if quick else 20000
+    episode_steps = 90 * 24
+    mesa_sizes = [10, 137] if quick else [10, 50, 137]
+    columnar_sizes = [1000, 100000] if quick else [1000, 100000, 1000000]
+
+    benchmarks = [
+        Benchmark('env.step', 'steps', *_env_steps(steps), steps),
+        Benchmark('env.step[precompute]', 'steps', *_env_steps(steps, precompute=True), steps),
+        Benchmark('env.step_index', 'steps', *_env_steps(steps, packed=True), steps),
+        Benchmark('agent.choose_action', 'steps', *_agent(steps), steps),
+        Benchmark('agent.choose_action[compact]', 'steps', *_agent(steps, compact=True), steps),
+        Benchmark('agent.learn', 'steps', *_agent(steps, method='learn'), steps),
+        Benchmark('agent.learn[compact]', 'steps', *_agent(steps, compact=True, method='learn'), steps),
+        Benchmark('agent.choose_actions', 'steps', *_agent(steps, method='choose_actions'), steps),
+        Benchmark('agent.learn_batch', 'steps', *_agent(steps, method='learn_batch'), steps),
+        Benchmark('replay.replay', 'transitions', *_replay(steps), steps // 64 * 64),
+        Benchmark('replay.replay[prioritized]', 'transitions', *_replay(steps, prioritized=True), steps // 64 * 64),
+        Benchmark('model.train_agent[1 episode]', 'steps', *_energy_model('train_agent'), episode_steps),
+        Benchmark('model.train_agent[1 episode, compact]', 'steps', *_energy_model('train_agent', compact=True),
+                  episode_steps),
+        Benchmark('model.test_agent_exploitation', 'steps', *_energy_model('test_agent_exploitation'), episode_steps),
+        Benchmark('model.test_random_policy', 'steps', *_energy_model('test_random_policy'), episode_steps),
+    ]
+    for size in mesa_sizes:
+        for phase in ('construct', 'step', 'collect_data'):
+            benchmarks.append(Benchmark(f'abm.{phase}[{size}]', 'households', *_household_model(size, phase), size))
+    for size in columnar_sizes:
+        for phase in ('construct', 'step', 'collect_data'):
+            benchmarks.append(Benchmark(f'population.{phase}[{size}]', 'households',
+                                        *_household_model(size, phase, columnar=True), size))
+    return benchmarks
+
+
+def run_benchmarks(benchmarks, repeat=3, name_filter=None):
+    results = {}
+    for benchmark in benchmarks:
+        if name_filter and name_filter not in benchmark.name:
+            continue
+        np.random.seed(0)
+        result = benchmark.measure(repeat)
+        results[benchmark.name] = result
+        print(f"{benchmark.name:45s} {result['throughput']:>14,.0f} {result['unit']}/s "
+              f"{result['peak_memory_bytes'] / 2 ** 20:>10.2f} MiB peak")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline and return the list of regressions.
+
+    A case regresses when its throughput drops, or its peak memory grows, by more than `tolerance`
+    (a fraction) compared with the baseline.
+    """
+    regressions = []
+    print(f"\n{'benchmark':45s} {'throughput':>12s} {'memory':>10s}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:45s} {'new':>12s}")
+            continue
+        reference = baseline[name]
+        speed = result['throughput'] / reference['throughput']
+        memory = result['peak_memory_bytes'] / max(reference['peak_memory_bytes'], 1)
+        flags = []
+        if speed < 1 - tolerance:
+            flags.append('SLOWER')
+        if memory > 1 + tolerance and result['peak_memory_bytes'] - reference['peak_memory_bytes'] > 2 ** 20:
+            flags.append('MORE MEMORY')
+        print(f"{name:45s} {speed:>11.2f}x {memory:>9.2f}x {' '.join(flags)}")
+        if flags:
+            regressions.append((name, flags))
+    return regressions
+
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    document = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro and macro benchmarks of the household energy simulation")
+    parser.add_argument('--quick', action='store_true', help="Smaller sizes for a fast smoke run")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per benchmark, the best one is kept")
+    parser.add_argument('--filter', help="Only run benchmarks whose name contains this string")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON file to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="Store the results as the new baseline")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown/memory growth")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(build_benchmarks(quick=args.quick), repeat=args.repeat, name_filter=args.filter)
+    if args.output:
+        save_results(results, args.output)
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}")
+            return 1
+        print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+import argparse
+import json
+import sys
+
+# Only the standard library is imported here. Each subcommand imports what it needs, so e.g. `evaluate` never
+# pays for mesa, pandas or matplotlib.
+
+
+def _add_model_arguments(parser):
+    parser.add_argument('--season', choices=['winter', 'summer'], default='winter')
+    parser.add_argument('--rooms', type=int, default=3, help="Number of rooms of the house")
+    parser.add_argument('--episodes', type=int, default=2000, help="Number of training episodes")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the training run")
+    parser.add_argument('--compact', action='store_true', help="Use the compact Q-table fast path")
+    parser.add_argument('--update-rule', choices=['q', 'q_lambda', 'n_step'], default='q',
+                        help="One-step Q-learning, Watkins's Q(lambda) or n-step Q-learning")
+    parser.add_argument('--trace-decay', type=float, default=0.9, help="lambda of Q(lambda)")
+    parser.add_argument('--n-steps', type=int, default=4, help="Number of rewards in the n-step return")
+    parser.add_argument('--early-stop', action='store_true',
+                        help="Stop training once the Q-table and greedy policy have converged (--episodes is the cap)")
+    parser.add_argument('--epsilon-decay', type=float,
+                        help="Per-episode epsilon decay (default 0.97 with --early-stop or --warm-start, otherwise none)")
+    parser.add_argument('--trace', help="Write the per-episode convergence trace to this JSON file")
+    parser.add_argument('--replay', type=int, default=0, metavar='CAPACITY',
+                        help="Replay minibatches from an experience replay buffer of this many transitions")
+    parser.add_argument('--replay-batch', type=int, default=64, help="Transitions per replayed minibatch")
+    parser.add_argument('--prioritized', action='store_true', help="Sample replayed transitions by TD error")
+    parser.add_argument('--replay-file', help="Load the replay buffer from this .npz file if it exists, and save "
+                                              "it there after training")
+    parser.add_argument('--cache-dir', default='data/policy_cache', help="Directory of the trained policy cache")
+    parser.add_argument('--series', help="Directory of memory-mapped tariff/temperature series (see time_series.py)")
+    parser.add_argument('--region', type=int, help="Region column of multi-region series")
+    parser.add_argument('--peak-price', type=float, help="Peak electricity price (pence per kWh)")
+    parser.add_argument('--off-peak-price', type=float, help="Off-peak electricity price (pence per kWh)")
+    parser.add_argument('--gas-price', type=float, help="Gas price (pence per kWh)")
+    parser.add_argument('--warm-start', action='store_true',
+                        help="Start training from the cached table of the closest tariff, season and rooms")
+    _add_instrumentation_arguments(parser)
+
+
+def _add_instrumentation_arguments(parser):
+    parser.add_argument('--profile', action='store_true', help="Print per-phase wall/CPU times and counters")
+    parser.add_argument('--metrics', help="Write the per-episode training curve to this JSONL file")
+
+
+def _build_model(args):
+    from main import EnergyModel
+    from policy_cache import PolicyCache
+
+    series = None
+    if args.series:
+        from time_series import EnergyTimeSeries
+        series = EnergyTimeSeries.load(args.series, region=args.region)
+    tariff = {name: getattr(args, name) for name in ('peak_price', 'off_peak_price', 'gas_price')
+              if getattr(args, name) is not None}
+    agent_params = None
+    if args.update_rule != 'q':
+        agent_params = {'update_rule': args.update_rule, 'trace_decay': args.trace_decay, 'n_steps': args.n_steps}
+    return EnergyModel(0, args.rooms, args.season, compact=args.compact, agent_params=agent_params,
+                       policy_cache=PolicyCache(args.cache_dir), series=series, tariff=tariff or None)
+
+
+def _train_agent(model, args):
+    convergence = None
+    if args.early_stop:
+        from convergence import ConvergenceMonitor
+        convergence = ConvergenceMonitor()
+    epsilon_decay = args.epsilon_decay
+    if epsilon_decay is None:
+        epsilon_decay = 0.97 if args.early_stop or args.warm_start else 1.0
+    replay = None
+    if args.replay:
+        import os
+        from replay import ReplayBuffer
+        agent = model.q_learning_agent
+        if args.replay_file and os.path.exists(args.replay_file):
+            replay = ReplayBuffer.load(args.replay_file, capacity=args.replay, batch_size=args.replay_batch,
+                                       prioritized=args.prioritized)
+        else:
+            replay = ReplayBuffer(args.replay, agent.num_states, agent.num_actions, batch_size=args.replay_batch,
+                                  prioritized=args.prioritized, seed=args.seed)
+    convergence = model.train_agent(episodes=args.episodes, seed=args.seed, convergence=convergence,
+                                    epsilon_decay=epsilon_decay, warm_start=args.warm_start, replay=replay)
+    if replay is not None:
+        print(f"Replay buffer: {len(replay)} transitions, {replay.bytes_per_transition} bytes per transition, "
+              f"{replay.nbytes / 1e6:.2f} MB")
+        if args.replay_file:
+            replay.save(args.replay_file)
+    if model.warm_start is not None:
+        report = model.warm_start
+        print(f"Warm start from {report['source']} (distance {report['distance']:.3f}): "
+              f"{report['episodes']} episodes instead of {report['cold_start_episodes']}, "
+              f"{report['episodes_saved']} saved")
+    if convergence is not None:
+        print(convergence.report())
+        if args.trace:
+            with open(args.trace, 'w') as f:
+                json.dump(convergence.to_dict(), f, indent=2)
+
+
+def _print_result(name, result, as_json):
+    electricity, gas, cost = result
+    if as_json:
+        print(json.dumps({'policy': name, 'electricity': electricity, 'gas': gas, 'cost': cost}))
+    else:
+        print(f"{name}: Total Electricity Usage: {electricity:.2f} kWh, Total Gas Usage: {gas:.2f} kWh, "
+              f"Total Cost: £{cost:.2f}")
+
+
+def _print_baseline(baseline, as_json):
+    summary = baseline.summary()
+    if as_json:
+        print(json.dumps({'policy': 'random', 'trials': len(baseline.cost), 'confidence': baseline.confidence,
+                          **summary}))
+        return
+    print(f"Random Policy ({len(baseline.cost)} trials, {baseline.confidence:.0%} intervals):")
+    for name, unit in (('electricity', 'kWh'), ('gas', 'kWh'), ('cost', '£')):
+        values = summary[name]
+        print(f"  {name.capitalize():12s} mean {values['mean']:.2f} {unit} (std {values['std']:.2f}), "
+              f"CI of mean [{values['ci_low']:.2f}, {values['ci_high']:.2f}], "
+              f"trials [{values['interval_low']:.2f}, {values['interval_high']:.2f}]")
+
+
+def train(args):
+    model = _build_model(args)
+    if args.method == 'value-iteration':
+        planner = model.plan_agent()
+        print(f"Solved with value iteration in {planner.iterations} iterations")
+    else:
+        _train_agent(model, args)
+        episodes = model.convergence.episodes_used if model.convergence is not None else args.episodes
+        print(f"Trained {args.season} agent ({episodes} episodes, seed {args.seed})")
+    if args.output:
+        model.q_learning_agent.save_q_table(args.output)
+        print(f"Saved Q-table to {args.output}")
+    if args.export:
+        from policy_server import export_policy
+        export_policy(model.q_learning_agent, args.export)
+        print(f"Exported greedy policy to {args.export}")
+
+
+def evaluate(args):
+    import numpy as np
+
+    model = _build_model(args)
+    if args.q_table:
+        model.q_learning_agent.load_q_table(args.q_table, mmap_mode='r')
+    elif 'trained' in args.policy:
+        _train_agent(model, args)
+
+    np.random.seed(args.eval_seed)
+    if 'trained' in args.policy:
+        _print_result('Trained Agent', model.test_agent_exploitation(), args.json)
+    if 'random' in args.policy:
+        if args.trials:
+            _print_baseline(model.random_baseline(trials=args.trials, seed=args.eval_seed), args.json)
+        else:
+            _print_result('Random Policy', model.test_random_policy(), args.json)
+
+
+def simulate_abm(args):
+    import numpy as np
+
+    np.random.seed(args.seed)
+    if args.columnar:
+        from models.population import HouseholdPopulation
+        model = HouseholdPopulation(args.households, args.season, seed=args.seed)
+    else:
+        from models.model import HouseholdEnergyModel
+        model = HouseholdEnergyModel(args.households, args.season)
+    for _ in range(args.steps):
+        model.step()
+
+    household_data = model.collect_data()
+    if args.output:
+        household_data.to_csv(args.output, index=False)
+        print(f"Saved {len(household_data)} households to {args.output}")
+    else:
+        print(f"Simulated {len(household_data)} households for {args.steps} steps")
+
+
+def plot(args):
+    # Non-interactive backend, so figures are only written to files and nothing blocks
+    import matplotlib
+    matplotlib.use('Agg')
+    import numpy as np
+    import pandas as pd
+    from visualisations import generate_comparison_graphs
+
+    model = _build_model(args)
+    _train_agent(model, args)
+    np.random.seed(args.eval_seed)
+    electricity_trained, gas_trained, cost_trained = model.test_agent_exploitation()
+    electricity_random, gas_random, cost_random = model.test_random_policy()
+
+    # ABM values of one household with as many people as rooms, as in EnergyModel.run
+    household_data = pd.read_csv(args.abm_data or f"data/household_energy_data_{args.season}.csv")
+    household = household_data[household_data["Num People"] == args.rooms].head(1)
+    electricity_abm = float(household["Electricity Usage"].sum())
+    gas_abm = float(household["Gas Usage"].sum())
+
+    generate_comparison_graphs(args.season, electricity_trained, gas_trained, cost_trained,
+                               electricity_random, gas_random, cost_random, electricity_abm, gas_abm, show=False)
+    print(f"Saved {args.season} comparison graphs to visualisations/")
+
+
+def render(args):
+    import pandas as pd
+    from rendering import render_figures, scenario_figures
+
+    if args.results.endswith('.jsonl'):
+        scenarios = pd.read_json(args.results, lines=True)
+    else:
+        scenarios = pd.read_csv(args.results)
+    counts = render_figures(scenario_figures(scenarios, args.kinds, args.key), args.output_dir, args.workers,
+                            args.force)
+    print(f"Rendered {counts['rendered']} figures, {counts['skipped']} unchanged, in {args.output_dir}")
+
+
+def fleet(args):
+    from fleet import FleetLoadEngine, train_policies
+    from policy_cache import PolicyCache
+
+    policy_mix = {}
+    for item in args.mix:
+        policy, _, share = item.partition('=')
+        policy_mix[policy] = float(share)
+    series = None
+    if args.series:
+        from time_series import EnergyTimeSeries
+        series = EnergyTimeSeries.load(args.series, region=args.region)
+    greedy_actions = None
+    if policy_mix.get('trained'):
+        greedy_actions = train_policies(args.season, args.episodes, args.seed, PolicyCache(args.cache_dir))
+
+    engine = FleetLoadEngine(args.households, args.season, policy_mix, greedy_actions, series, args.hours,
+                             args.seed)
+    load = engine.run()
+    if args.output:
+        import numpy as np
+        np.savez(args.output, electricity=load.electricity, gas=load.gas)
+    summary = load.summary()
+    if args.json:
+        print(json.dumps(summary))
+        return
+    print(f"District of {args.households} households ({', '.join(f'{n} {p}' for p, n in load.households.items())}), "
+          f"{summary['hours']} hours:")
+    for name in ('electricity', 'gas'):
+        values = summary[name]
+        percentiles = ', '.join(f"{key} {value:.0f}" for key, value in values['percentiles'].items())
+        print(f"  {name.capitalize():12s} total {values['total']:.0f} kWh, peak {values['peak_load']:.0f} kWh at hour "
+              f"{values['peak_hour']}, percentiles {percentiles}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Household energy simulation")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help="Train (or load from the cache) a Q-learning agent")
+    _add_model_arguments(train_parser)
+    train_parser.add_argument('--method', choices=['q-learning', 'value-iteration'], default='q-learning')
+    train_parser.add_argument('--output', help="Save the Q-table to this .npy file")
+    train_parser.add_argument('--export', help="Export the greedy policy to this <name>.policy.npz file for "
+                                               "policy_server.py")
+    train_parser.set_defaults(func=train)
+
+    evaluate_parser = subparsers.add_parser('evaluate', help="Evaluate the trained and/or random policy")
+    _add_model_arguments(evaluate_parser)
+    evaluate_parser.add_argument('--policy', nargs='+', choices=['trained', 'random'], default=['trained', 'random'])
+    evaluate_parser.add_argument('--q-table', help="Evaluate this .npy Q-table instead of a (cached) trained one")
+    evaluate_parser.add_argument('--eval-seed', type=int, default=0, help="Seed of the evaluation")
+    evaluate_parser.add_argument('--json', action='store_true', help="Print one JSON object per policy")
+    evaluate_parser.add_argument('--trials', type=int, default=0,
+                                 help="Summarise the random policy over this many Monte Carlo trials")
+    evaluate_parser.set_defaults(func=evaluate)
+
+    abm_parser = subparsers.add_parser('simulate-abm', help="Run the agent-based household model")
+    abm_parser.add_argument('--season', choices=['winter', 'summer'], default='winter')
+    abm_parser.add_argument('--households', type=int, default=137)
+    abm_parser.add_argument('--steps', type=int, default=0)
+    abm_parser.add_argument('--seed', type=int, default=0)
+    abm_parser.add_argument('--columnar', action='store_true', help="Use the columnar population model")
+    abm_parser.add_argument('--output', help="Save the household data to this CSV file")
+    _add_instrumentation_arguments(abm_parser)
+    abm_parser.set_defaults(func=simulate_abm)
+
+    plot_parser = subparsers.add_parser('plot', help="Write the comparison graphs (non-interactive)")
+    _add_model_arguments(plot_parser)
+    plot_parser.add_argument('--eval-seed', type=int, default=0, help="Seed of the evaluation")
+    plot_parser.add_argument('--abm-data', help="Household data CSV (default data/household_energy_data_<season>.csv)")
+    plot_parser.set_defaults(func=plot)
+
+    render_parser = subparsers.add_parser('render', help="Render the figures of many scenario results (e.g. a sweep)")
+    render_parser.add_argument('results', help="Scenario results (.jsonl as written by sweep.py, or .csv)")
+    render_parser.add_argument('--output-dir', default='visualisations/scenarios')
+    render_parser.add_argument('--kinds', nargs='+', choices=['comparison', 'energy_usage'],
+                               default=['comparison', 'energy_usage'])
+    render_parser.add_argument('--key', default='job_id', help="Column identifying a scenario")
+    render_parser.add_argument('--workers', type=int, default=None, help="Rendering processes (default: all CPUs)")
+    render_parser.add_argument('--force', action='store_true', help="Render figures even if their data is unchanged")
+    _add_instrumentation_arguments(render_parser)
+    render_parser.set_defaults(func=render)
+
+    fleet_parser = subparsers.add_parser('fleet', help="Hourly district load of a population with mixed policies")
+    fleet_parser.add_argument('--households', type=int, default=10000)
+    fleet_parser.add_argument('--season', choices=['winter', 'summer'], default='winter')
+    fleet_parser.add_argument('--mix', nargs='+', default=['abm=1'],
+                              help="Share of households per policy, e.g. trained=0.3 random=0.5 abm=0.2")
+    fleet_parser.add_argument('--hours', type=int, help="Hours to simulate (default: a year, or the whole series)")
+    fleet_parser.add_argument('--seed', type=int, default=0, help="Seed of the population and of training")
+    fleet_parser.add_argument('--episodes', type=int, default=2000, help="Training episodes of the trained policies")
+    fleet_parser.add_argument('--cache-dir', default='data/policy_cache', help="Directory of the trained policy cache")
+    fleet_parser.add_argument('--series', help="Directory of memory-mapped tariff/temperature series")
+    fleet_parser.add_argument('--region', type=int, help="Region column of multi-region series")
+    fleet_parser.add_argument('--output', help="Save the hourly load curves to this .npz file")
+    fleet_parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    _add_instrumentation_arguments(fleet_parser)
+    fleet_parser.set_defaults(func=fleet)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not (args.profile or args.metrics):
+        args.func(args)
+        return
+
+    import instrumentation
+    metrics = instrumentation.enable(args.metrics)
+    try:
+        with metrics.phase(args.command):
+            args.func(args)
+    finally:
+        instrumentation.disable()
+    if args.profile:
+        print(metrics.report())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
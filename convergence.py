@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class ConvergenceMonitor:
+    def __init__(self, window=10, tolerance=0.01, max_policy_changes=0, min_episodes=0):
+        """
+        Decide when Q-learning has converged, from the change of the Q-table over a window of episodes.
+
+        After every episode the monitor records the largest change of a Q-value since the previous episode
+        (relative to the largest absolute Q-value, so the tolerance does not depend on the scale of the rewards)
+        and the number of states whose greedy action changed. Training has converged once, over the last
+        `window` episodes, every change was below `tolerance` and the greedy policy changed in at most
+        `max_policy_changes` states in total.
+
+        Parameters:
+        - window: Number of consecutive episodes both criteria must hold for.
+        - tolerance: Largest allowed relative change of a Q-value per episode.
+        - max_policy_changes: Largest allowed number of greedy action changes over the window.
+        - min_episodes: Never report convergence before this many episodes.
+        """
+        self.window = window
+        self.tolerance = tolerance
+        self.max_policy_changes = max_policy_changes
+        self.min_episodes = min_episodes
+        self.trace = []  # One record per episode
+        self.converged = False
+        self._previous_q = None
+        self._previous_policy = None
+
+    @property
+    def episodes_used(self):
+        return len(self.trace)
+
+    def settings(self):
+        return {
+            'window': self.window,
+            'tolerance': self.tolerance,
+            'max_policy_changes': self.max_policy_changes,
+            'min_episodes': self.min_episodes,
+        }
+
+    def start(self, agent):
+        """
+        Take the snapshot of the Q-table before the first episode.
+        """
+        self._previous_q = self._q_values(agent)
+        self._previous_policy = self._previous_q.argmax(axis=1)
+
+    @staticmethod
+    def _q_values(agent):
+        # Dense float64 copy of the Q-table in the (num_states, num_actions) layout
+        return np.array(agent.q_table, dtype=np.float64).reshape(agent.num_states, agent.num_actions)
+
+    def update(self, episode, agent):
+        """
+        Record a finished episode.
+
+        Returns:
+        - True once training has converged.
+        """
+        if self._previous_q is None:
+            self.start(agent)
+        q_values = self._q_values(agent)
+        policy = q_values.argmax(axis=1)
+        scale = np.abs(q_values).max()
+        change = np.abs(q_values - self._previous_q).max() / scale if scale > 0 else 0.0
+        self.trace.append({
+            'episode': episode,
+            'max_q_change': float(change),
+            'policy_changes': int((policy != self._previous_policy).sum()),
+            'epsilon': float(agent.epsilon),
+        })
+        self._previous_q = q_values
+        self._previous_policy = policy
+
+        recent = self.trace[-self.window:]
+        self.converged = (len(self.trace) >= max(self.window, self.min_episodes) and
+                          all(record['max_q_change'] < self.tolerance for record in recent) and
+                          sum(record['policy_changes'] for record in recent) <= self.max_policy_changes)
+        return self.converged
+
+    def to_dict(self):
+        return {'settings': self.settings(), 'converged': self.converged, 'trace': self.trace}
+
+    @classmethod
+    def from_dict(cls, data):
+        monitor = cls(**data['settings'])
+        monitor.converged = data['converged']
+        monitor.trace = data['trace']
+        return monitor
+
+    def report(self):
+        if not self.trace:
+            return "No episodes trained"
+        last = self.trace[-1]
+        status = "Converged" if self.converged else "Did not converge"
+        return (f"{status} after {self.episodes_used} episodes (max relative Q change {last['max_q_change']:.2e}, "
+                f"epsilon {last['epsilon']:.4f})")
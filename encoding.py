@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def radix_weights(sizes):
+    """
+    Return the mixed-radix place values used to pack a vector with the given per-dimension sizes.
+
+    The packing follows NumPy's C order, so the code of a vector is its flat index in an array of shape
+    `sizes`. For binary switches this is plain bit-packing with the first switch as the most significant bit.
+
+    Parameters:
+    - sizes: List with the number of values of each dimension, e.g. [2, 2, 2, 2, 2].
+
+    Returns:
+    - List of Python ints, one place value per dimension.
+    """
+    weights = []
+    weight = 1
+    for size in reversed(sizes):
+        weights.append(weight)
+        weight *= int(size)
+    return weights[::-1]
+
+
+def encode(vectors, sizes):
+    """
+    Pack one vector, or an array of vectors along the last axis, into integer codes.
+
+    Parameters:
+    - vectors: Array-like of shape (..., len(sizes)).
+    - sizes: List with the number of values of each dimension.
+
+    Returns:
+    - Integer code (or array of codes) in range(prod(sizes)).
+    """
+    vectors = np.asarray(vectors)
+    return np.ravel_multi_index(tuple(np.moveaxis(vectors, -1, 0)), sizes)
+
+
+def decode(codes, sizes):
+    """
+    Unpack integer codes back into vectors. Inverse of `encode`.
+
+    Parameters:
+    - codes: Integer code or array of codes.
+    - sizes: List with the number of values of each dimension.
+
+    Returns:
+    - Array of shape (..., len(sizes)).
+    """
+    return np.stack(np.unravel_index(codes, sizes), axis=-1)
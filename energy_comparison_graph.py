@@ -1,6 +1,6 @@
 import matplotlib.pyplot as plt
 
-def generate_season_comparison_graphs(data):
+def generate_season_comparison_graphs(data, show=True):
     seasons = ['Winter', 'Summer']
     policies = ['Trained Agent', 'Random Policy']
 
@@ -24,4 +24,6 @@ def generate_season_comparison_graphs(data):
     plt.suptitle('Comparison of Energy Costs')
     plt.tight_layout()
     plt.savefig('visualisations/energy_cost_comparison.png')
-    plt.show()
+    if show:
+        plt.show()
+    plt.close(fig)
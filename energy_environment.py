@@ -2,9 +2,24 @@ import gym
 from gym import spaces
 import numpy as np
 
+from encoding import radix_weights, encode, decode
+
+# Prices of set_seasonal_parameters that a tariff can override
+TARIFF_PRICES = ['peak_price', 'off_peak_price', 'gas_price']
+
+# Usage record of one step: energy in kWh, prices in £ per kWh and costs in £ (the reward is minus the total cost)
+STEP_RECORD = np.dtype([
+    ('electricity', np.float64),
+    ('gas', np.float64),
+    ('electricity_price', np.float64),
+    ('gas_price', np.float64),
+    ('electricity_cost', np.float64),
+    ('gas_cost', np.float64),
+])
+
 
 class EnergyEnvironment(gym.Env):
-    def __init__(self, num_rooms=1, season='winter'):
+    def __init__(self, num_rooms=1, season='winter', precompute=False, series=None, tariff=None, trace=False):
         super(EnergyEnvironment, self).__init__()
 
         # Define action and observation space
@@ -17,8 +32,28 @@ class EnergyEnvironment(gym.Env):
         self.current_day = 0
         self.state = [0, 0, 1, 0, 0]  # Initial state, fridge is always on
 
+        # Optional EnergyTimeSeries with hourly prices; it then sets the length of an episode
+        self.series = series
+        self.num_days = series.num_days if series is not None else 90  # Length of an episode
+        self.num_hours = series.num_hours if series is not None else self.num_days * 24
+
         self.set_seasonal_parameters()
 
+        # Optional dict overriding some of 'peak_price', 'off_peak_price' and 'gas_price' (pence per kWh)
+        self.tariff = tariff
+        for name, price in (tariff or {}).items():
+            if name not in TARIFF_PRICES:
+                raise ValueError(f"Unknown tariff price {name!r}, expected some of {TARIFF_PRICES}")
+            setattr(self, name, price)
+
+        # Optionally compile rewards and transitions into lookup tables, making step a table lookup
+        self.precompute = precompute
+        if precompute:
+            self.compile_tables()
+
+        # Optionally record every step of an episode in a preallocated STEP_RECORD array, filled by step
+        self.trace = np.zeros(self.num_hours, dtype=STEP_RECORD) if trace else None
+
     def set_seasonal_parameters(self):
         # Electricity prices (pence per kWh)
         self.peak_price = 24.50  # pence per kWh
@@ -49,9 +84,93 @@ class EnergyEnvironment(gym.Env):
         self.state = [0, 0, 1, 0, 0]
         self.current_hour = 0
         self.current_day = 0
+        if self.trace is not None:
+            self.trace[:] = 0
+        if self.precompute:
+            self.state_index = sum(w * s for w, s in zip(self._action_weights, self.state))
         return np.array(self.state)
 
-    def step(self, action):
+    def compile_tables(self):
+        """
+        Precompute the reward and transition tables for the current season and number of rooms.
+
+        The reward only depends on the hour of day and the action, and the next state is the action itself
+        (with the fridge forced on), so the whole dynamics fit in two small tables indexed by packed codes
+        (see encoding.py):
+        - reward_table: (24, num_actions) array, reward_table[hour, action_index].
+        - transition_table: (num_states, num_actions) array, transition_table[state_index, action_index]
+          gives the next state index.
+        - state_vectors: (num_states, 5) array mapping a state index back to its state vector.
+        - electricity_usage_table, gas_usage_table: (num_actions,) energy used by each action, which with the
+          price of the hour gives the reward when a time series sets the prices.
+        The tables are computed with the same expression as `step`, so lookups are exact. With a time series,
+        reward_table holds the rewards at the mean price of each hour of day, for planners that need a daily
+        profile.
+        """
+        sizes = list(self.action_space.nvec)
+        self._action_weights = radix_weights(sizes)
+        self.state_vectors = decode(np.arange(int(np.prod(sizes))), sizes)
+        self.state_vectors.setflags(write=False)
+
+        # _reward is evaluated element-wise on all actions at once
+        prices = self.series.daily_price_profile() / 100 if self.series is not None else [None] * 24
+        self.reward_table = np.array([self._reward(self.state_vectors.T, hour, prices[hour]) for hour in range(24)])
+        self.reward_table.setflags(write=False)
+        self.electricity_usage_table, self.gas_usage_table = self._usage(self.state_vectors.T)
+        self.electricity_usage_table.setflags(write=False)
+        self.gas_usage_table.setflags(write=False)
+
+        next_states = self.state_vectors.copy()
+        next_states[:, 2] = 1  # Fridge is always on
+        next_state_index = encode(next_states, sizes)
+        self.transition_table = np.tile(next_state_index, (len(self.state_vectors), 1))
+        self.transition_table.setflags(write=False)
+        self.state_index = sum(w * s for w, s in zip(self._action_weights, self.state))
+
+        # Python list copies of the tables for the scalar lookups of step and step_index, which are much faster
+        # than indexing NumPy arrays one element at a time. The next state does not depend on the current one
+        self._reward_rows = self.reward_table.tolist()
+        self._next_state_index = next_state_index.tolist()
+        self._electricity_usage = self.electricity_usage_table.tolist()
+        self._gas_usage = self.gas_usage_table.tolist()
+
+    def hourly_prices(self, start, stop):
+        """
+        Return the (stop - start,) electricity prices (£ per kWh) of hours [start, stop) of an episode.
+        """
+        if self.series is not None:
+            return self.series.hourly_prices(start, stop) / 100
+        hours = np.arange(start, stop) % 24
+        is_peak = ((7 <= hours) & (hours < 17)) | ((19 <= hours) & (hours < 23))
+        return np.where(is_peak, self.peak_price / 100, self.off_peak_price / 100)
+
+    def records(self, action_indices, start=0):
+        """
+        Return the STEP_RECORD array of taking a sequence of packed actions from hour `start` of an episode, the
+        records `step` would return one at a time (compiled tables only).
+        """
+        action_indices = np.asarray(action_indices)
+        records = np.zeros(len(action_indices), dtype=STEP_RECORD)
+        records['electricity'] = self.electricity_usage_table[action_indices]
+        records['gas'] = self.gas_usage_table[action_indices]
+        records['electricity_price'] = self.hourly_prices(start, start + len(action_indices))
+        records['gas_price'] = self.gas_price / 100
+        records['electricity_cost'] = records['electricity'] * records['electricity_price']
+        records['gas_cost'] = records['gas'] * records['gas_price']
+        return records
+
+    def reward_rows(self, start, stop):
+        """
+        Return the (stop - start, num_actions) rewards of every action at hours [start, stop) of an episode
+        (compiled tables only). Without a time series these are rows of reward_table.
+        """
+        if self.series is None:
+            return self.reward_table[np.arange(start, stop) % 24]
+        prices = self.series.hourly_prices(start, stop) / 100
+        return -(self.electricity_usage_table * prices[:, None] + self.gas_usage_table * (self.gas_price / 100))
+
+    def _usage(self, action):
+        # Electricity and gas used by an action (element-wise on arrays of actions)
         light, washing_machine, fridge, gas_heating, gas_cooking = action
         fridge = 1
 
@@ -70,23 +189,119 @@ class EnergyEnvironment(gym.Env):
             electricity_used += 2 * self.appliance_usage['heating']
         if 'cooling' in self.appliance_usage:
             electricity_used += 1 * self.appliance_usage['cooling']
+        return electricity_used, gas_used
+
+    def _reward(self, action, hour, electricity_price=None):
+        electricity_used, gas_used = self._usage(action)
+        if electricity_price is None:
+            electricity_price = self._tariff_price(hour)
+
+        gas_price = self.gas_price / 100
+        return -(electricity_used * electricity_price + gas_used * gas_price)
 
-        if 7 <= self.current_hour < 17 or 19 <= self.current_hour < 23:
-            electricity_price = self.peak_price / 100
+    def _tariff_price(self, hour):
+        # Without a time series, the price (£ per kWh) follows the fixed peak/off-peak tariff
+        if 7 <= hour < 17 or 19 <= hour < 23:
+            return self.peak_price / 100
+        return self.off_peak_price / 100
+
+    def step(self, action):
+        """
+        Take an action for the current hour.
+
+        Returns:
+        - (next state, reward, done, info), where info is the usage record of the step: the STEP_RECORD fields
+          (electricity and gas used, their prices and costs) by name. With trace=True the record is also stored
+          in self.trace at the step's hour of the episode.
+        """
+        if self.precompute:
+            return self._step_table(action)
+
+        light, washing_machine, fridge, gas_heating, gas_cooking = action
+        if self.series is None:
+            electricity_price = self._tariff_price(self.current_hour)
         else:
-            electricity_price = self.off_peak_price / 100
+            electricity_price = self._series_price()
+        electricity_used, gas_used = self._usage(action)
+        info = self._record(electricity_used, gas_used, electricity_price)
+        reward = -(info['electricity_cost'] + info['gas_cost'])  # Same as _reward
 
+        self.state = [light, washing_machine, 1, gas_heating, gas_cooking]
+        self._advance_clock()
+        done = self.current_day * 24 + self.current_hour >= self.num_hours
+
+        return np.array(self.state), reward, done, info
+
+    def step_index(self, action_index):
+        """
+        Take a packed action index for the current hour (compiled tables only): the lean lookup path for callers
+        that keep states and actions packed (see encoding.py). No usage record is built or traced.
+
+        Returns:
+        - (next state index, reward, done).
+        """
+        if self.series is None:
+            reward = self._reward_rows[self.current_hour][action_index]
+        else:
+            reward = -(self._electricity_usage[action_index] * self._series_price() +
+                       self._gas_usage[action_index] * (self.gas_price / 100))
+        self.state_index = self._next_state_index[action_index]
+        # Inlined _advance_clock
+        self.current_hour += 1
+        if self.current_hour == 24:
+            self.current_hour = 0
+            self.current_day += 1
+        return self.state_index, reward, self.current_day * 24 + self.current_hour >= self.num_hours
+
+    def _step_table(self, action):
+        # Table lookup equivalent of step; the returned state is a read-only row of state_vectors
+        weights = self._action_weights
+        action_index = (weights[0] * int(action[0]) + weights[1] * int(action[1]) + weights[2] * int(action[2]) +
+                        weights[3] * int(action[3]) + weights[4] * int(action[4]))
+        electricity_used = self._electricity_usage[action_index]
+        gas_used = self._gas_usage[action_index]
+        if self.series is None:
+            electricity_price = self._tariff_price(self.current_hour)
+            reward = self._reward_rows[self.current_hour][action_index]
+        else:
+            electricity_price = self._series_price()
+            reward = -(electricity_used * electricity_price + gas_used * (self.gas_price / 100))
+        info = self._record(electricity_used, gas_used, electricity_price)
+        self.state_index = self._next_state_index[action_index]
+        next_state = self.state_vectors[self.state_index]
+
+        self.state = next_state
+        self._advance_clock()
+        done = self.current_day * 24 + self.current_hour >= self.num_hours
+
+        return next_state, reward, done, info
+
+    def _record(self, electricity_used, gas_used, electricity_price):
+        # Usage record of the current step, also written to the trace when there is one
         gas_price = self.gas_price / 100
-        reward = -(electricity_used * electricity_price + gas_used * gas_price)
+        info = {
+            'electricity': electricity_used,
+            'gas': gas_used,
+            'electricity_price': electricity_price,
+            'gas_price': gas_price,
+            'electricity_cost': electricity_used * electricity_price,
+            'gas_cost': gas_used * gas_price,
+        }
+        if self.trace is not None:
+            hour = self.current_day * 24 + self.current_hour
+            if hour < len(self.trace):
+                self.trace[hour] = tuple(info.values())
+        return info
 
-        self.state = [light, washing_machine, fridge, gas_heating, gas_cooking]
+    def _series_price(self):
+        # Electricity price (£ per kWh) of the current hour of the episode from the time series
+        return self.series.price(self.current_day * 24 + self.current_hour) / 100
+
+    def _advance_clock(self):
         self.current_hour += 1
         if self.current_hour >= 24:
             self.current_hour = 0
             self.current_day += 1
-        done = self.current_day >= 90
-
-        return np.array(self.state), reward, done, {}
 
     def render(self, mode='human'):
         print(f"Day: {self.current_day}, Hour: {self.current_hour}, State: {self.state}")
@@ -0,0 +1,237 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+import instrumentation
+from energy_environment import EnergyEnvironment
+from policy_evaluation import RANDOM_SWITCHES, RandomPolicy, switch_decomposition
+from models.parameters import HOUSE_TYPES
+from models.population import HouseholdPopulation
+
+POLICIES = ['trained', 'random', 'abm']
+
+# Number of rooms of the EnergyEnvironment of each house type, in HOUSE_TYPES order
+HOUSE_TYPE_ROOMS = [1, 3, 4]
+
+# The ABM usage parameters are annual totals
+HOURS_PER_YEAR = 365 * 24
+
+# Households generated, and hours simulated, at a time
+HOUSEHOLD_CHUNK = 100_000
+CHUNK_HOURS = 24 * 28
+
+
+@dataclass
+class FleetLoad:
+    """
+    District load of a fleet of households: hourly aggregate demand (kWh per hour) and its statistics.
+    """
+    electricity: np.ndarray
+    gas: np.ndarray
+    households: dict  # policy -> number of households
+    percentiles: tuple
+
+    def peak(self, name='electricity'):
+        """
+        Return (hour, load) of the highest hourly load.
+        """
+        load = getattr(self, name)
+        hour = int(load.argmax())
+        return hour, float(load[hour])
+
+    def summary(self):
+        summary = {'households': self.households, 'hours': len(self.electricity)}
+        for name in ('electricity', 'gas'):
+            load = getattr(self, name)
+            peak_hour, peak_load = self.peak(name)
+            summary[name] = {
+                'total': float(load.sum()),
+                'mean': float(load.mean()),
+                'peak_hour': peak_hour,
+                'peak_load': peak_load,
+                'percentiles': {f"p{q:g}": float(value)
+                                for q, value in zip(self.percentiles, np.percentile(load, self.percentiles))},
+            }
+        return summary
+
+
+class FleetLoadEngine:
+    def __init__(self, num_households, season, policy_mix=None, greedy_actions=None, series=None, hours=None,
+                 seed=None):
+        """
+        Hourly electricity and gas demand of a whole district of ABM households.
+
+        Every household of a columnar ABM population (HouseholdPopulation) is given a policy and the
+        EnergyEnvironment of its house type (see HOUSE_TYPE_ROOMS):
+        - 'trained': the greedy policy of a trained agent for its house type. It is deterministic, so all
+          households of a house type draw the same hourly demand.
+        - 'random': the random baseline policy. Every switch is drawn independently per household and hour, so the
+          number of households of a house type with a switch on in an hour is Binomial(households, p), which is
+          drawn directly instead of simulating each household.
+        - 'abm': the household's own annual ABM usage, spread over the hours with the expected daily profile of
+          the random policy of its house type.
+        The demand of an hour is the energy used by the environment for the chosen action (electricity_usage_table
+        and gas_usage_table).
+
+        Households are generated in chunks of HOUSEHOLD_CHUNK and reduced to per-(policy, house type) counts and
+        usage totals, and hours are simulated in chunks of CHUNK_HOURS, so memory depends on neither the number of
+        households nor, apart from the load curves themselves, the number of hours.
+
+        Parameters:
+        - num_households: Number of households of the district.
+        - season: 'winter' or 'summer'.
+        - policy_mix: Share of households per policy, e.g. {'trained': 0.3, 'random': 0.7}. Defaults to all 'abm'.
+        - greedy_actions: For trained households, the greedy action table of each house type (house type ->
+          (num_states,) packed actions, see policy_server.compile_policy and `train_policies`).
+        - series: Optional EnergyTimeSeries; its temperatures set the cold hours of the random policy.
+        - hours: Number of hours to simulate. Defaults to a year, or to the whole series.
+        - seed: Seed of the population, policy assignment and random policy draws.
+        """
+        self.num_households = num_households
+        self.season = season
+        self.policy_mix = policy_mix or {'abm': 1.0}
+        unknown = set(self.policy_mix) - set(POLICIES)
+        if unknown:
+            raise ValueError(f"Unknown policies {sorted(unknown)}, expected some of {POLICIES}")
+        self.greedy_actions = greedy_actions or {}
+        if self.policy_mix.get('trained') and set(self.greedy_actions) != set(HOUSE_TYPES):
+            raise ValueError("Trained households need greedy_actions for every house type")
+        self.series = series
+        self.hours = hours if hours is not None else (series.num_hours if series is not None else HOURS_PER_YEAR)
+        if series is not None and self.hours > series.num_hours:
+            raise ValueError(f"The series covers {series.num_hours} hours, {self.hours} were asked for")
+        self.seed = seed
+        self.household_counts = None  # (policies, house types) number of households, set by iter_load
+
+        self.envs = [EnergyEnvironment(num_rooms=rooms, season=season, precompute=True) for rooms in HOUSE_TYPE_ROOMS]
+
+    def _population_totals(self, seed_sequence, rng):
+        """
+        Generate the population in chunks and return the (policies, house types) number of households and the
+        (house types,) total annual ABM electricity and gas of the 'abm' households.
+        """
+        shares = np.array([self.policy_mix.get(policy, 0.0) for policy in POLICIES], dtype=float)
+        shares /= shares.sum()
+        counts = np.zeros((len(POLICIES), len(HOUSE_TYPES)), dtype=np.int64)
+        abm_electricity = np.zeros(len(HOUSE_TYPES))
+        abm_gas = np.zeros(len(HOUSE_TYPES))
+        abm = POLICIES.index('abm')
+
+        num_chunks = -(-self.num_households // HOUSEHOLD_CHUNK)
+        chunk_seeds = seed_sequence.spawn(num_chunks)
+        for chunk_seed, start in zip(chunk_seeds, range(0, self.num_households, HOUSEHOLD_CHUNK)):
+            size = min(HOUSEHOLD_CHUNK, self.num_households - start)
+            population = HouseholdPopulation(size, self.season, grid=False, seed=chunk_seed)
+            policy = rng.choice(len(POLICIES), size=size, p=shares)
+            group = policy * len(HOUSE_TYPES) + population.house_type
+            counts += np.bincount(group, minlength=counts.size).reshape(counts.shape)
+            is_abm = policy == abm
+            abm_electricity += np.bincount(population.house_type[is_abm], population.electricity_usage[is_abm],
+                                           minlength=len(HOUSE_TYPES))
+            abm_gas += np.bincount(population.house_type[is_abm], population.gas_usage[is_abm],
+                                   minlength=len(HOUSE_TYPES))
+        return counts, abm_electricity, abm_gas
+
+    def _greedy_usage(self, house_type):
+        # (hours,) electricity and gas of one household following the greedy policy from the reset state
+        env = self.envs[house_type]
+        actions = np.asarray(self.greedy_actions[HOUSE_TYPES[house_type]])
+        next_state = env.transition_table[0]
+        action_index = np.empty(self.hours, dtype=np.int64)
+        state = env.state_index
+        # The state is the previous action, so the sequence is periodic after at most num_states steps
+        seen = {}
+        for hour in range(self.hours):
+            if state in seen:
+                cycle = action_index[seen[state]:hour]
+                action_index[hour:] = np.resize(cycle, self.hours - hour)
+                break
+            seen[state] = hour
+            action_index[hour] = actions[state]
+            state = next_state[action_index[hour]]
+        return env.electricity_usage_table[action_index], env.gas_usage_table[action_index]
+
+    def _switch_usage(self):
+        """
+        Return the (house types,) usage with only the fridge on and the (house types, 4) extra usage of each other
+        switch, for electricity and gas (see policy_evaluation.switch_decomposition).
+        """
+        sizes = list(self.envs[0].action_space.nvec)
+        return {name: switch_decomposition([getattr(env, f"{name}_usage_table") for env in self.envs], sizes)
+                for name in ('electricity', 'gas')}
+
+    def _switch_probabilities(self, start, stop):
+        # (stop - start, 4) probability of each random policy switch being on at each hour
+        cold = self.series.cold_hours(start, stop) if self.series is not None else None
+        return RandomPolicy(self.season).switch_probabilities(np.arange(start, stop), cold)[:, RANDOM_SWITCHES]
+
+    def iter_load(self):
+        """
+        Yield (start hour, electricity, gas) for consecutive chunks of hours, with the district load (kWh) of each
+        hour of the chunk.
+        """
+        # Every run starts from the seed, so iterating twice gives the same load
+        population_seed, draw_seed = np.random.SeedSequence(self.seed).spawn(2)
+        rng = np.random.default_rng(draw_seed)
+        with instrumentation.phase('fleet_population'):
+            counts, abm_electricity, abm_gas = self._population_totals(population_seed, rng)
+        self.household_counts = counts
+        trained, random, abm = (counts[POLICIES.index(policy)] for policy in POLICIES)
+
+        greedy = [self._greedy_usage(house_type) if trained[house_type] else None
+                  for house_type in range(len(HOUSE_TYPES))]
+        switch_usage = self._switch_usage()
+
+        # Expected random policy usage per hour of day of each house type, normalised to a mean of 1
+        daily_probabilities = RandomPolicy(self.season).switch_probabilities()[:, RANDOM_SWITCHES]
+        profiles = {}
+        for name, (base, extra) in switch_usage.items():
+            expected = base[:, None] + extra @ daily_probabilities.T  # (house types, 24)
+            profiles[name] = expected / np.maximum(expected.mean(axis=1, keepdims=True), 1e-12)
+        abm_hourly = {'electricity': abm_electricity / HOURS_PER_YEAR, 'gas': abm_gas / HOURS_PER_YEAR}
+
+        for start in range(0, self.hours, CHUNK_HOURS):
+            stop = min(start + CHUNK_HOURS, self.hours)
+            with instrumentation.phase('fleet_chunk'):
+                hours = np.arange(start, stop) % 24
+                load = {name: abm_hourly[name] @ profiles[name][:, hours] for name in profiles}
+
+                for house_type, usage in enumerate(greedy):
+                    if usage is not None:
+                        load['electricity'] += trained[house_type] * usage[0][start:stop]
+                        load['gas'] += trained[house_type] * usage[1][start:stop]
+
+                if random.any():
+                    # (house types, hours, switches) number of random households with each switch on
+                    on = rng.binomial(random[:, None, None], self._switch_probabilities(start, stop)[None])
+                    for name, (base, extra) in switch_usage.items():
+                        load[name] += random @ base + np.einsum('khs,ks->h', on, extra)
+            yield start, load['electricity'], load['gas']
+
+    def run(self, percentiles=(50, 90, 95, 99)):
+        """
+        Simulate the whole horizon and return the FleetLoad.
+        """
+        electricity = np.empty(self.hours)
+        gas = np.empty(self.hours)
+        for start, chunk_electricity, chunk_gas in self.iter_load():
+            electricity[start:start + len(chunk_electricity)] = chunk_electricity
+            gas[start:start + len(chunk_gas)] = chunk_gas
+        households = dict(zip(POLICIES, self.household_counts.sum(axis=1).tolist()))
+        return FleetLoad(electricity, gas, households, tuple(percentiles))
+
+
+def train_policies(season, episodes=2000, seed=0, policy_cache=None, **train_kwargs):
+    """
+    Train (or load from the cache) one agent per house type and return house type -> greedy action table.
+    """
+    from main import EnergyModel
+    from policy_server import compile_policy
+
+    greedy_actions = {}
+    for house_type, rooms in zip(HOUSE_TYPES, HOUSE_TYPE_ROOMS):
+        model = EnergyModel(0, rooms, season, compact=True, policy_cache=policy_cache)
+        model.train_agent(episodes, seed=seed, **train_kwargs)
+        agent = model.q_learning_agent
+        greedy_actions[house_type] = compile_policy(agent.q_table, agent.state_size, agent.action_size)
+    return greedy_actions
@@ -1,35 +1,31 @@
+import argparse
+import os
+
 import pandas as pd
-import matplotlib.pyplot as plt
+
+from rendering import household_usage_figure, render_figures
 
 # Define seasons
 seasons = ['winter', 'summer']
 
-# Create a figure for the plots
-plt.figure(figsize=(10, 7))
-
-for i, season in enumerate(seasons):
-    # Load the collected data for the season
-    df = pd.read_csv(f"household_energy_data_{season}.csv")
 
-    # Prepare the data for plotting
-    house_sizes = df["Num People"]
-    electricity_usage = df["Electricity Usage"]
-    gas_usage = df["Gas Usage"]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plot house size against electricity and gas usage per season")
+    parser.add_argument('--data-dir', default='data', help="Directory of household_energy_data_<season>.csv")
+    parser.add_argument('--output-dir', default='visualisations')
+    parser.add_argument('--force', action='store_true', help="Render even if the data is unchanged")
+    args = parser.parse_args(argv)
 
-    # Create subplots
-    plt.subplot(1, 2, i + 1)  # Two subplots: one for each season (side by side)
+    # Load the collected data for each season
+    household_data = {season: pd.read_csv(os.path.join(args.data_dir, f"household_energy_data_{season}.csv"))
+                      for season in seasons}
 
-    # Plot both electricity and gas usage on the same graph
-    plt.scatter(house_sizes, electricity_usage, c='blue', label='Electricity Usage (kWh)', marker='o')
-    plt.scatter(house_sizes, gas_usage, c='red', label='Gas Usage (kWh)', marker='x')
+    counts = render_figures([household_usage_figure(household_data)], args.output_dir, workers=1, force=args.force)
+    if counts['rendered']:
+        print(f"Saved {os.path.join(args.output_dir, 'household_size_vs_usage.png')}")
+    else:
+        print("Household data unchanged, figure not rendered")
 
-    # Add labels and title
-    plt.xlabel('House Size (Number of People)')
-    plt.ylabel('Usage (kWh)')
-    plt.title(f'{season.capitalize()} - House Size vs Usage')
-    plt.legend()
 
-# Adjust layout for better spacing
-plt.tight_layout()
-# Display the plots
-plt.show()
+if __name__ == "__main__":
+    main()
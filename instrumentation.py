@@ -0,0 +1,131 @@
+import contextlib
+import json
+import time
+from collections import Counter
+
+import numpy as np
+
+# The active Instrumentation, or None when instrumentation is disabled. Hooks in the hot paths only check this
+# global (`instrumentation.active is not None`), so disabled instrumentation costs one lookup and comparison.
+active = None
+
+_NULL_PHASE = contextlib.nullcontext()
+
+
+class Instrumentation:
+    def __init__(self, stream_path=None):
+        """
+        Collects per-phase timers, counters and the per-episode training curve.
+
+        Parameters:
+        - stream_path: Optional JSONL file; one line is appended per finished training episode with the total
+          reward, mean absolute TD error and epsilon.
+        """
+        self.phases = {}  # name -> [calls, wall seconds, CPU seconds]
+        self.counters = Counter()
+        self.episodes = []
+        self.stream = open(stream_path, 'w') if stream_path else None
+        self._td_error_sum = 0.0
+        self._td_error_count = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time the enclosed block (wall and CPU time) and add it to the totals of phase `name`.
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.phases.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += time.perf_counter() - wall_start
+            totals[2] += time.process_time() - cpu_start
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def td_error(self, value):
+        # Called from QLearningAgent.learn for every update
+        self._td_error_sum += abs(value)
+        self._td_error_count += 1
+
+    def td_errors(self, values):
+        # Called from QLearningAgent.learn_batch with the TD errors of a whole batch
+        self._td_error_sum += float(np.abs(values).sum())
+        self._td_error_count += len(values)
+
+    def end_episode(self, episode, total_reward, epsilon, steps):
+        """
+        Record one finished training episode and write it to the stream.
+        """
+        record = {
+            'episode': episode,
+            'total_reward': float(total_reward),
+            'mean_td_error': self._td_error_sum / self._td_error_count if self._td_error_count else 0.0,
+            'epsilon': float(epsilon),
+            'steps': steps,
+        }
+        self.counters['episodes'] += 1
+        self.counters['steps'] += steps
+        self.counters['updates'] += self._td_error_count
+        self._td_error_sum = 0.0
+        self._td_error_count = 0
+
+        self.episodes.append(record)
+        if self.stream is not None:
+            self.stream.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        return {
+            'phases': {name: {'calls': calls, 'wall_seconds': wall, 'cpu_seconds': cpu}
+                       for name, (calls, wall, cpu) in self.phases.items()},
+            'counters': dict(self.counters),
+        }
+
+    def report(self):
+        lines = [f"{'phase':30s} {'calls':>8s} {'wall (s)':>10s} {'cpu (s)':>10s}"]
+        for name, (calls, wall, cpu) in sorted(self.phases.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:30s} {calls:>8d} {wall:>10.3f} {cpu:>10.3f}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:30s} {value:>8d}")
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+def enable(stream_path=None):
+    """
+    Turn instrumentation on and return the new Instrumentation.
+    """
+    global active
+    disable()
+    active = Instrumentation(stream_path)
+    return active
+
+
+def disable():
+    """
+    Turn instrumentation off, closing the training-curve stream.
+    """
+    global active
+    if active is not None:
+        active.close()
+    active = None
+
+
+def current():
+    return active
+
+
+def phase(name):
+    """
+    Time the enclosed block as phase `name` if instrumentation is enabled, otherwise do nothing.
+    """
+    if active is None:
+        return _NULL_PHASE
+    return active.phase(name)
@@ -1,84 +1,334 @@
-from models.agent import Household
-from models.model import HouseholdEnergyModel
 from q_learning_agent import QLearningAgent
+from encoding import encode
 from energy_environment import EnergyEnvironment
+from policy_evaluation import GreedyPolicy, RandomPolicy, evaluate_policy, evaluate_random_policy_monte_carlo
+from value_iteration import ValueIterationPlanner
+from policy_cache import PolicyCache, training_key
+from convergence import ConvergenceMonitor
+import instrumentation
 import numpy as np
-from visualisations import generate_comparison_graphs
-from energy_comparison_graph import generate_season_comparison_graphs
-import pandas as pd
+
+# Hours of time-series rewards converted for the compact training loop at a time
+REWARD_BLOCK_HOURS = 24 * 7
+
+# mesa, pandas and matplotlib are slow to import, so they are imported where they are used; training and
+# evaluation do not need them
 
 
 class EnergyModel:
-    def __init__(self, num_households, num_rooms, season):
+    def __init__(self, num_households, num_rooms, season, compact=False, columnar_abm=False, agent_params=None,
+                 policy_cache=None, series=None, tariff=None):
         self.num_households = num_households
         self.num_rooms = num_rooms
         self.season = season
-        self.household_model = HouseholdEnergyModel(num_households, season)
+        # Optional EnergyTimeSeries of tariff and temperature; it sets the prices and the episode length
+        self.series = series
+        # Optional prices overriding the fixed tariff of the environment (see EnergyEnvironment)
+        self.tariff = tariff
+        self.policy_cache = policy_cache  # Optional PolicyCache of trained Q-tables
+        # columnar_abm=True uses the struct-of-arrays population, which scales to millions of households
+        self.columnar_abm = columnar_abm
+        self._household_model = None
+        self._evaluation_cache = {}  # (policy fingerprint, environment key, seed) -> PolicyEvaluation
+        self._series_fingerprint = None  # (series, fingerprint) of the last series evaluated
+        self.convergence = None  # ConvergenceMonitor of the last train_agent run with early stopping
+        self.warm_start = None  # Report of the last warm-started train_agent run
+        self.replay = None  # ReplayBuffer of the last train_agent run with experience replay
 
         # Updated to include 5 actions (light, washing_machine, fridge, gas_heating, gas_cooking)
-        self.q_learning_agent = QLearningAgent(state_size=[2, 2, 2, 2, 2], action_size=[2, 2, 2, 2, 2])
+        # compact=True uses the packed-index Q-table fast path of the agent, agent_params overrides the
+        # default alpha/gamma/epsilon
+        self.q_learning_agent = QLearningAgent(state_size=[2, 2, 2, 2, 2], action_size=[2, 2, 2, 2, 2],
+                                               compact=compact, **(agent_params or {}))
+
+    @property
+    def household_model(self):
+        # The household model is built on first use, so runs that only train or evaluate never import mesa
+        if self._household_model is None:
+            if self.columnar_abm:
+                from models.population import HouseholdPopulation
+                self._household_model = HouseholdPopulation(self.num_households, self.season)
+            else:
+                from models.model import HouseholdEnergyModel
+                self._household_model = HouseholdEnergyModel(self.num_households, self.season)
+        return self._household_model
+
+    def _environment(self, precompute=False):
+        return EnergyEnvironment(num_rooms=self.num_rooms, season=self.season, precompute=precompute,
+                                 series=self.series, tariff=self.tariff)
+
+    def train_agent(self, episodes=2000, seed=None, convergence=None, epsilon_decay=1.0, warm_start=False,
+                    replay=None):
+        """
+        Train the Q-learning agent.
+
+        Parameters:
+        - episodes: Number of training episodes, or the maximum number with early stopping.
+        - seed: Seed of the training run; seeded runs can be served from the policy cache.
+        - convergence: Optional ConvergenceMonitor. Training stops as soon as it reports convergence, and it is
+          kept as self.convergence with the number of episodes used and the per-episode trace.
+        - epsilon_decay: Epsilon is multiplied by this (through QLearningAgent.update_epsilon) after every episode.
+        - warm_start: If no table is cached for these exact settings, start from the cached table of the closest
+          tariff, season and number of rooms (PolicyCache.nearest) instead of all zeros, and train until the
+          policy has converged again (with a default ConvergenceMonitor if none is given). self.warm_start then
+          reports the table started from and the episodes saved against a cold start.
+        - replay: Optional ReplayBuffer. Every transition is also stored in it, and minibatches of stored
+          transitions are replayed through the agent's vectorised update (see ReplayBuffer.step). The buffer
+          keeps its transitions after training, so it can be saved and reused by later runs. Runs with replay
+          are not served from or stored in the policy cache, which does not hold buffers.
+
+        Returns:
+        - The ConvergenceMonitor, or None without early stopping.
+        """
+        self.warm_start = None
+        self.replay = replay
+        if warm_start:
+            if self.policy_cache is None:
+                raise ValueError("Warm starts need a policy cache to start from")
+            if convergence is None:
+                convergence = ConvergenceMonitor()
+        self.convergence = convergence
+        if seed is None:
+            source = None
+            if warm_start and not self.q_learning_agent.q_table.any():
+                source = self._load_warm_start(self._training_key(episodes, seed, convergence, epsilon_decay))
+            self._train(episodes, convergence, epsilon_decay)
+            if source is not None:
+                self.warm_start = self._warm_start_report(source, convergence)
+            return convergence
+
+        # A seeded run draws from its own stream and leaves the global one untouched, so the outcome of
+        # everything after training is the same whether the table was trained or loaded from the cache
+        rng_state = np.random.get_state()
+        try:
+            key = None
+            source = None
+            # Cached tables are trained from a known start, so the cache only applies to an untrained agent
+            untrained = not self.q_learning_agent.q_table.any()
+            if replay is not None:
+                if warm_start and untrained:
+                    source = self._load_warm_start(self._training_key(episodes, seed, convergence, epsilon_decay))
+            elif self.policy_cache is not None and untrained:
+                key = self._training_key(episodes, seed, convergence, epsilon_decay)
+                with instrumentation.phase('policy_cache'):
+                    hit = self.policy_cache.load(key, self.q_learning_agent)
+                    if not hit and warm_start:
+                        # A warm-started run is cached under the key of the table it started from
+                        source = self.policy_cache.nearest(key)
+                        if source is not None:
+                            key = self._training_key(episodes, seed, convergence, epsilon_decay, source[0])
+                            hit = self.policy_cache.load(key, self.q_learning_agent)
+                if hit:
+                    # Restore what training would have left besides the table
+                    metadata = self.policy_cache.metadata(key) or {}
+                    self.q_learning_agent.epsilon = metadata.get('epsilon', self.q_learning_agent.epsilon)
+                    if convergence is not None and 'convergence' in metadata:
+                        self.convergence = ConvergenceMonitor.from_dict(metadata['convergence'])
+                    self.warm_start = metadata.get('warm_start')
+                    return self.convergence
+                if source is not None and not self.policy_cache.load(source[1]['key'], self.q_learning_agent):
+                    # The table to start from is stale, train from zeros
+                    source = None
+                    key = self._training_key(episodes, seed, convergence, epsilon_decay)
+
+            np.random.seed(seed)
+            self._train(episodes, convergence, epsilon_decay)
+            if source is not None:
+                self.warm_start = self._warm_start_report(source, convergence)
+            if key is not None:
+                extra = {'epsilon': self.q_learning_agent.epsilon}
+                if convergence is not None:
+                    extra['convergence'] = convergence.to_dict()
+                if self.warm_start is not None:
+                    extra['warm_start'] = self.warm_start
+                self.policy_cache.store(key, self.q_learning_agent, **extra)
+        finally:
+            np.random.set_state(rng_state)
+        return convergence
+
+    def _training_key(self, episodes, seed, convergence, epsilon_decay, warm_start=None):
+        return training_key(self._environment(), self.q_learning_agent, episodes, seed, convergence, epsilon_decay,
+                            warm_start)
+
+    def _load_warm_start(self, key):
+        # Load the cached table closest to key into the agent and return the PolicyCache.nearest entry, or None
+        source = self.policy_cache.nearest(key)
+        if source is not None and not self.policy_cache.load(source[1]['key'], self.q_learning_agent):
+            source = None
+        return source
+
+    @staticmethod
+    def _warm_start_report(source, convergence):
+        """
+        Report a warm-started run. The cold start it is compared with is the run that trained the source table
+        from zeros: the episodes it needed to converge, or the episodes it was trained for.
+        """
+        digest, metadata, distance = source
+        if 'warm_start' in metadata:
+            cold_start_episodes = metadata['warm_start']['cold_start_episodes']
+        elif metadata.get('convergence', {}).get('converged'):
+            cold_start_episodes = len(metadata['convergence']['trace'])
+        else:
+            cold_start_episodes = metadata['key']['episodes']
+        return {
+            'source': digest,
+            'distance': distance,
+            'source_environment': metadata['key']['environment'],
+            'episodes': convergence.episodes_used,
+            'converged': convergence.converged,
+            'cold_start_episodes': cold_start_episodes,
+            'episodes_saved': cold_start_episodes - convergence.episodes_used,
+        }
 
-    def train_agent(self, episodes=2000):
-        env = EnergyEnvironment(num_rooms=self.num_rooms, season=self.season)
+    def _train(self, episodes, convergence=None, epsilon_decay=1.0):
+        with instrumentation.phase('train_agent'):
+            if convergence is not None:
+                convergence.start(self.q_learning_agent)
+            if self.q_learning_agent.compact:
+                self._train_agent_compact(episodes, convergence, epsilon_decay)
+            else:
+                self._train_agent(episodes, convergence, epsilon_decay)
+
+    def _end_episode(self, episode, convergence, epsilon_decay):
+        # Decay epsilon, then return True if training has converged
+        if epsilon_decay != 1.0:
+            self.q_learning_agent.update_epsilon(epsilon_decay)
+        return convergence is not None and convergence.update(episode, self.q_learning_agent)
+
+    def _train_agent(self, episodes, convergence=None, epsilon_decay=1.0):
+        env = self._environment()
+        replay = self.replay
+        agent = self.q_learning_agent
 
         for episode in range(episodes):
             state = env.reset()
+            self.q_learning_agent.start_episode()
             done = False
+            total_reward = 0
             while not done:
                 action = self.q_learning_agent.choose_action(state)
                 next_state, reward, done, _ = env.step(action)
                 self.q_learning_agent.learn(state, action, reward, next_state)
+                if replay is not None:
+                    replay.step(agent, int(encode(state, agent.state_size)), int(encode(action, agent.action_size)),
+                                reward, int(encode(next_state, agent.state_size)))
                 state = next_state
+                total_reward += reward
+            self.q_learning_agent.end_episode()
+            if instrumentation.active is not None:
+                instrumentation.active.end_episode(episode, total_reward, self.q_learning_agent.epsilon,
+                                                   env.num_hours)
+            if self._end_episode(episode, convergence, epsilon_decay):
+                break
+
+    def _train_agent_compact(self, episodes, convergence=None, epsilon_decay=1.0):
+        # Same loop as train_agent, but states and actions stay packed integer indices and the environment
+        # is replaced by lookups in its precomputed reward and transition tables
+        agent = self.q_learning_agent
+        env = self._environment(precompute=True)
+        steps = env.num_hours
+        # Rewards repeat daily with the fixed tariff. With a time series they are read a block of hours at a
+        # time as the episode advances, so only one block of the series is ever held as Python lists
+        reward_block = 24 if self.series is None else REWARD_BLOCK_HOURS
+        daily_rewards = env.reward_rows(0, 24).tolist() if self.series is None else None
+        transition_table = env.transition_table.tolist()
+        initial_state_index = env.state_index
+        replay = self.replay
 
-    def test_agent_exploitation(self):
-        env = EnergyEnvironment(num_rooms=self.num_rooms, season=self.season)
-        state = env.reset()
-        total_energy_used = 0
-        total_gas_used = 0
-        total_cost = 0
-
-        # Conversion factor from gas units to kWh
-        gas_to_kwh_conversion_factor = 11.2
-
-        # Multipliers for different heating levels and temperature impact
-        gas_heating_multiplier = 3.5 if self.season == 'winter' else 1.0  # Increased multiplier for winter
-
-        for _ in range(90):  # Simulate for 90 days
-            for hour in range(24):
-                action = self.q_learning_agent.choose_action(state)  # Exploit best known action
-                state, reward, done, _ = env.step(action)
-
-                # Calculate electricity usage and cost
-                energy_used = -reward / (
-                    env.peak_price / 100 if 7 <= hour < 17 or 19 <= hour < 23 else env.off_peak_price / 100)
-                cost = energy_used * (
-                    env.peak_price / 100 if 7 <= hour < 17 or 19 <= hour < 23 else env.off_peak_price / 100)
-
-                # Simulate gas usage based on gas_heating and gas_cooking actions
-                # Introduce temperature and peak heating periods to vary gas usage
-                is_cold_hour = hour < 7 or hour >= 19  # Assume colder usage in early mornings and late evenings
-                temperature_factor = 2.0 if is_cold_hour and self.season == 'winter' else 1.0  # Higher heating at colder hours
-
-                # Gas heating usage based on time of day and temperature factor
-                gas_heating = action[-2] * env.appliance_usage.get('gas_heating',
-                                                                   0) * gas_heating_multiplier * temperature_factor
-                gas_cooking = action[-1] * env.appliance_usage.get('gas_cooking', 0)  # Cooking gas usage remains fixed
-
-                # Total gas used
-                gas_used_in_units = gas_heating + gas_cooking
-
-                gas_used_in_kwh = gas_used_in_units * gas_to_kwh_conversion_factor
-
-                # Update totals
-                total_energy_used += energy_used
-                total_gas_used += gas_used_in_kwh
-                total_cost += cost + (gas_used_in_kwh * 0.04)  # Assuming 0.04 £ per unit of gas
-
-        return total_energy_used, total_gas_used, total_cost
+        for episode in range(episodes):
+            state_index = initial_state_index
+            total_reward = 0
+            agent.start_episode()
+            for step in range(steps):
+                if step % reward_block == 0:
+                    rewards = (daily_rewards if daily_rewards is not None else
+                               env.reward_rows(step, min(step + reward_block, steps)).tolist())
+                action_index = agent.choose_action_index(state_index)
+                next_state_index = transition_table[state_index][action_index]
+                reward = rewards[step % reward_block][action_index]
+                agent.learn_index(state_index, action_index, reward, next_state_index)
+                if replay is not None:
+                    replay.step(agent, state_index, action_index, reward, next_state_index)
+                state_index = next_state_index
+                total_reward += reward
+            agent.end_episode()
+            if instrumentation.active is not None:
+                instrumentation.active.end_episode(episode, total_reward, agent.epsilon, steps)
+            if self._end_episode(episode, convergence, epsilon_decay):
+                break
+
+    def plan_agent(self):
+        # Exact alternative to train_agent: solve the environment with value iteration and load the result
+        env = self._environment(precompute=True)
+        planner = ValueIterationPlanner(env, gamma=self.q_learning_agent.gamma).solve()
+        planner.apply_to(self.q_learning_agent)
+        return planner
 
-    def run(self):
+    def test_agent_exploitation(self):
+        # Evaluate the agent's epsilon-greedy policy for 90 days
+        return self.evaluate_agent().totals()
+
+    def evaluate_agent(self, seed=None):
+        # Full PolicyEvaluation (totals and per-hour series) of the agent's current Q-table
+        return self._evaluate(GreedyPolicy.from_agent(self.q_learning_agent), seed, 'test_agent_exploitation')
+
+    def evaluate_random_policy(self, seed=None):
+        # Full PolicyEvaluation (totals and per-hour series) of the random baseline policy
+        return self._evaluate(RandomPolicy(self.season), seed, 'test_random_policy')
+
+    def random_baseline(self, trials=10000, seed=None, confidence=0.95):
+        # Distribution of the random baseline over many independent trials (MonteCarloEvaluation), with the
+        # model's tariff and time series
+        with instrumentation.phase('random_baseline'):
+            return evaluate_random_policy_monte_carlo(self.num_rooms, self.season, trials=trials, seed=seed,
+                                                      confidence=confidence, series=self.series,
+                                                      tariff=self.tariff)
+
+    def _evaluate(self, policy, seed, phase_name):
+        """
+        Evaluate a policy, memoized by the policy fingerprint, the environment (see _environment_key) and seed.
+
+        Evaluating the same Q-table (or the random policy) again returns the stored result instead of running and
+        sampling again, so repeated calls are free and always agree. With a seed, the evaluation draws from its
+        own stream and leaves the global one untouched; without one, the first result drawn from the global
+        stream is the one kept.
+        """
+        key = (policy.fingerprint(), self._environment_key(), seed)
+        result = self._evaluation_cache.get(key)
+        if result is not None:
+            if instrumentation.active is not None:
+                instrumentation.active.count('evaluation_cache_hits')
+            return result
+
+        with instrumentation.phase(phase_name):
+            if seed is None:
+                result = evaluate_policy(policy, self.num_rooms, self.season, series=self.series,
+                                         tariff=self.tariff)
+            else:
+                rng_state = np.random.get_state()
+                try:
+                    np.random.seed(seed)
+                    result = evaluate_policy(policy, self.num_rooms, self.season, series=self.series,
+                                             tariff=self.tariff)
+                finally:
+                    np.random.set_state(rng_state)
+        self._evaluation_cache[key] = result
+        return result
+
+    def _environment_key(self):
+        # Everything besides the policy and seed that an evaluation depends on. The series is hashed once per
+        # series object, since hashing reads the whole series
+        series_fingerprint = None
+        if self.series is not None:
+            if self._series_fingerprint is None or self._series_fingerprint[0] is not self.series:
+                self._series_fingerprint = (self.series, self.series.fingerprint())
+            series_fingerprint = self._series_fingerprint[1]
+        tariff = tuple(sorted(self.tariff.items())) if self.tariff else None
+        return self.num_rooms, self.season, tariff, series_fingerprint
+
+    def run(self, seed=None, show=True):
         print(f"\nTraining agent for {self.season} season...")
-        self.train_agent()
+        self.train_agent(seed=seed)
         print(f"Testing agent for {self.season} season...")
 
         # Test agent performance
@@ -89,11 +339,11 @@ class EnergyModel:
 
         # Collect household data and filter ABM values for only one household with num_people = 3
         household_data = self.collect_data()
-        abm_data = next((entry for entry in household_data if entry[1] == 3), None)  # Select only one household
+        abm_data = household_data[household_data["Num People"] == 3].head(1)  # Select only one household
 
-        if abm_data:
-            total_electricity_usage_abm = abm_data[2]  # Electricity Usage for one household
-            total_gas_usage_abm = abm_data[3]  # Gas Usage for one household
+        if len(abm_data):
+            total_electricity_usage_abm = abm_data["Electricity Usage"].iloc[0]  # Electricity Usage for one household
+            total_gas_usage_abm = abm_data["Gas Usage"].iloc[0]  # Gas Usage for one household
         else:
             total_electricity_usage_abm = total_gas_usage_abm = 0  # Handle case where no such household exists
 
@@ -116,62 +366,25 @@ class EnergyModel:
             f"Total Cost Reduction (vs Random): £{total_cost_random - total_cost_trained:.2f}\n")
 
         # Generate and save comparison graphs
-        generate_comparison_graphs(self.season, total_electricity_usage_trained, total_gas_usage_trained,
-                                   total_cost_trained,
-                                   total_electricity_usage_random, total_gas_usage_random, total_cost_random,
-                                   total_electricity_usage_abm, total_gas_usage_abm)
+        with instrumentation.phase('plot'):
+            from visualisations import generate_comparison_graphs
+            generate_comparison_graphs(self.season, total_electricity_usage_trained, total_gas_usage_trained,
+                                       total_cost_trained,
+                                       total_electricity_usage_random, total_gas_usage_random, total_cost_random,
+                                       total_electricity_usage_abm, total_gas_usage_abm, show=show)
 
     def collect_data(self):
-        return self.household_model.collect_data()
+        with instrumentation.phase('collect_data'):
+            return self.household_model.collect_data()
 
     def test_random_policy(self):
-        env = EnergyEnvironment(num_rooms=self.num_rooms, season=self.season)
-        state = env.reset()
-        total_energy_used = 0
-        total_gas_used = 0
-        total_cost = 0
-
-        gas_to_kwh_conversion_factor = 11.2
-
-        for day in range(90):
-            for hour in range(24):
-                light_action = np.random.choice([0, 1])
-                washing_machine_action = np.random.choice([0, 1])
-                fridge_action = 1  # Assume fridge is always on
-
-                if self.season == 'winter':
-                    gas_heating_action = np.random.choice([0, 1],
-                                                          p=[0.9, 0.1] if hour < 7 or hour >= 19 else [0.8, 0.2])
-                else:
-                    gas_heating_action = 0  # No heating needed in summer
-
-                if 7 <= hour < 9 or 17 <= hour < 19:
-                    gas_cooking_action = np.random.choice([0, 1], p=[0.8, 0.2])  # Reduced probability for cooking
-                else:
-                    gas_cooking_action = 0
-
-                action = [light_action, washing_machine_action, fridge_action, gas_heating_action, gas_cooking_action]
-                state, reward, done, _ = env.step(action)
-
-                energy_used = -reward / (
-                    env.peak_price / 100 if 7 <= hour < 17 or 19 <= hour < 23 else env.off_peak_price / 100)
-                cost = energy_used * (
-                    env.peak_price / 100 if 7 <= hour < 17 or 19 <= hour < 23 else env.off_peak_price / 100)
-
-                gas_heating = gas_heating_action * env.appliance_usage.get('gas_heating', 0)
-                gas_cooking = gas_cooking_action * env.appliance_usage.get('gas_cooking', 0)
-                gas_used_in_units = gas_heating + gas_cooking
-
-                gas_used_in_kwh = gas_used_in_units * gas_to_kwh_conversion_factor
-
-                total_energy_used += energy_used
-                total_gas_used += gas_used_in_kwh
-                total_cost += cost + (gas_used_in_kwh * 0.04)
-
-        return total_energy_used, total_gas_used, total_cost
+        # Evaluate the random baseline policy for 90 days
+        return self.evaluate_random_policy().totals()
 
 
 if __name__ == "__main__":
+    from energy_comparison_graph import generate_season_comparison_graphs
+
     num_households = 137
     num_rooms = 3
     seasons = ['winter', 'summer']
@@ -186,26 +399,25 @@ if __name__ == "__main__":
 
     for season in seasons:
         print(f"Running model for {season}...")
-        model = EnergyModel(num_households, num_rooms, season=season)
-        model.run()
+        # Trained Q-tables are cached, so later runs with the same settings skip training
+        model = EnergyModel(num_households, num_rooms, season=season, policy_cache=PolicyCache('data/policy_cache'))
+        model.run(seed=0)
         household_data = model.collect_data()
 
-        abm_data = [entry for entry in household_data if entry[1] == num_rooms]
+        abm_data = household_data[household_data["Num People"] == num_rooms]
 
-        total_electricity_usage_abm = sum(entry[2] for entry in abm_data)  # Electricity Usage
-        total_gas_usage_abm = sum(entry[3] for entry in abm_data)  # Gas Usage
+        total_electricity_usage_abm = abm_data["Electricity Usage"].sum()  # Electricity Usage
+        total_gas_usage_abm = abm_data["Gas Usage"].sum()  # Gas Usage
 
         # Save data to CSV file
-        df = pd.DataFrame(household_data,
-                          columns=["House Type", "Num People", "Electricity Usage", "Gas Usage", "Energy Saving"])
-        df.to_csv(f"data/household_energy_data_{season}.csv", index=False)
+        household_data.to_csv(f"data/household_energy_data_{season}.csv", index=False)
 
-        # Store results
+        # Store results; these are the evaluations already run by model.run(), served from its cache
         results[f'{season}_trained'] = {
-            'cost': model.test_agent_exploitation()[2]
+            'cost': model.evaluate_agent().cost
         }
         results[f'{season}_random'] = {
-            'cost': model.test_random_policy()[2]
+            'cost': model.evaluate_random_policy().cost
         }
 
     # Generate comparison graphs with all collected data
@@ -0,0 +1,146 @@
+import numpy as np
+
+from models.parameters import HOUSE_TYPES, ENERGY_SAVING_LABELS
+
+# Column name, dtype and (for categorical columns) categories of the collected agent variables
+COLUMNS = {
+    'Electricity Usage': (np.float64, None),
+    'Gas Usage': (np.float64, None),
+    'House Type': (np.int8, HOUSE_TYPES),
+    'Num People': (np.int8, None),
+    'Energy Saving': (np.int8, ENERGY_SAVING_LABELS),
+}
+
+# Column order of the household data (CSV files and collect_data)
+HOUSEHOLD_DATA_COLUMNS = ["House Type", "Num People", "Electricity Usage", "Gas Usage", "Energy Saving"]
+
+
+class ColumnarCollector:
+    def __init__(self, num_agents, season, capacity=64, ring=False):
+        """
+        Preallocated replacement of mesa's DataCollector for the household agent variables.
+
+        Every variable is a typed (capacity, num_agents) NumPy array with one row per collected step; house type
+        and energy saving are stored as int8 codes into HOUSE_TYPES and ENERGY_SAVING_LABELS. Collecting a step
+        copies the model's arrays into the next row instead of building a dict per agent.
+
+        Parameters:
+        - num_agents: Number of agents collected per step.
+        - season: Season of the model, reported as a constant column.
+        - capacity: Number of steps preallocated. Without ring, the buffers double in size when full.
+        - ring: If True, keep only the last `capacity` steps, overwriting the oldest, so memory stays bounded for
+          unbounded runs.
+        """
+        self.num_agents = num_agents
+        self.season = season
+        self.capacity = max(int(capacity), 1)
+        self.ring = ring
+        self.count = 0  # Number of steps collected so far
+        self.steps = np.zeros(self.capacity, dtype=np.int64)
+        self.columns = {name: np.zeros((self.capacity, num_agents), dtype=dtype)
+                        for name, (dtype, _) in COLUMNS.items()}
+
+    def __len__(self):
+        # Number of steps currently held
+        return min(self.count, self.capacity)
+
+    @property
+    def nbytes(self):
+        return self.steps.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        steps = np.zeros(capacity, dtype=np.int64)
+        steps[:self.capacity] = self.steps
+        self.steps = steps
+        for name, column in self.columns.items():
+            grown = np.zeros((capacity, self.num_agents), dtype=column.dtype)
+            grown[:self.capacity] = column
+            self.columns[name] = grown
+        self.capacity = capacity
+
+    def collect(self, values):
+        """
+        Record one step.
+
+        Parameters:
+        - values: Dict with a (num_agents,) array per column of COLUMNS, in agent order. Categorical columns hold
+          codes (booleans for 'Energy Saving').
+        """
+        if self.count >= self.capacity and not self.ring:
+            self._grow()
+        row = self.count % self.capacity
+        self.steps[row] = self.count
+        for name, column in self.columns.items():
+            column[row] = values[name]
+        self.count += 1
+
+    def _order(self):
+        # Rows of the held steps, oldest first, or a slice when they are stored in order
+        held = len(self)
+        if self.count <= self.capacity:
+            return slice(0, held)
+        start = self.count % self.capacity
+        return np.roll(np.arange(self.capacity), -start)
+
+    def step_values(self, name):
+        """
+        Return the (steps, num_agents) array of one column for the held steps, oldest first. This is a view of the
+        buffer unless a ring buffer has wrapped around.
+        """
+        return self.columns[name][self._order()]
+
+    def latest(self):
+        """
+        Return views of the last collected step, one (num_agents,) array per column.
+        """
+        if self.count == 0:
+            raise IndexError("No step has been collected yet")
+        row = (self.count - 1) % self.capacity
+        return {name: column[row] for name, column in self.columns.items()}
+
+    def to_dataframe(self):
+        """
+        Return the held steps as a long DataFrame indexed by (Step, AgentID), like
+        DataCollector.get_agent_vars_dataframe.
+
+        The numeric columns and the codes of the categorical columns are zero-copy views of the buffers (unless a
+        ring buffer has wrapped around), so the frame shares memory with the collector and is only valid until
+        the next collect.
+        """
+        import pandas as pd
+
+        order = self._order()
+        steps = self.steps[order]
+        index = pd.MultiIndex.from_product([steps, np.arange(self.num_agents)], names=["Step", "AgentID"])
+        data = {}
+        for name, (_, categories) in COLUMNS.items():
+            values = self.columns[name][order].reshape(-1)
+            data[name] = values if categories is None else pd.Categorical.from_codes(values, categories)
+        data["Season"] = pd.Categorical.from_codes(np.zeros(len(index), dtype=np.int8), [self.season])
+        return pd.DataFrame(data, index=index, copy=False)
+
+    # Drop-in name of mesa's DataCollector method
+    get_agent_vars_dataframe = to_dataframe
+
+
+def household_frame(values):
+    """
+    Build the household data table (HOUSEHOLD_DATA_COLUMNS, usages rounded to 2 decimals) of one step.
+
+    Parameters:
+    - values: Dict of (num_agents,) arrays as passed to ColumnarCollector.collect.
+    """
+    import pandas as pd
+
+    data = {}
+    for name in HOUSEHOLD_DATA_COLUMNS:
+        categories = COLUMNS[name][1]
+        column = np.asarray(values[name])
+        if categories is not None:
+            data[name] = pd.Categorical.from_codes(column.astype(np.int8), categories)
+        elif column.dtype.kind == 'f':
+            data[name] = np.round(column, 2)
+        else:
+            data[name] = column
+    return pd.DataFrame(data, copy=False)
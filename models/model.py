@@ -1,13 +1,15 @@
 from mesa import Model
 from mesa.time import RandomActivation
 from mesa.space import MultiGrid
-from mesa.datacollection import DataCollector
 import numpy as np
 from models.agent import Household
+from models.collector import ColumnarCollector, household_frame
+from models.parameters import ENERGY_USAGE_PARAMS, HOUSE_TYPES, HOUSEHOLD_SIZES
+import instrumentation
 
 
 class HouseholdEnergyModel(Model):
-    def __init__(self, num_households, season):
+    def __init__(self, num_households, season, collector=None):
         self.num_agents = num_households
         self.season = season
         self.schedule = RandomActivation(self)
@@ -15,14 +17,10 @@ class HouseholdEnergyModel(Model):
         self.running = True  # Model running state
 
         # Energy usage parameters annually (kWh) and their standard deviation
-        self.energy_usage_params = {
-            'Flat/1-bedroom': {'electricity': (1800, 270), 'gas': (7500, 1125)},
-            'Medium 2-3 bedroom': {'electricity': (2700, 405), 'gas': (11500, 1725)},
-            '4+ bedroom': {'electricity': (4100, 615), 'gas': (17000, 2550)}
-        }
+        self.energy_usage_params = ENERGY_USAGE_PARAMS
 
         # Distribution of household sizes
-        household_sizes = [1]*29 + [2]*47 + [3]*26 + [4]*23 + [5]*9 + [6]*3
+        household_sizes = list(HOUSEHOLD_SIZES)
         np.random.shuffle(household_sizes)  # Randomise the houses
 
         for i in range(self.num_agents):
@@ -38,17 +36,11 @@ class HouseholdEnergyModel(Model):
             y = self.random.randint(0, self.grid.height - 1)
             self.grid.place_agent(agent, (x, y))
 
-        # Initialise the DataCollector to collect specified data from agents
-        self.datacollector = DataCollector(
-            agent_reporters={
-                "Electricity Usage": "electricity_usage",
-                "Gas Usage": "gas_usage",
-                "House Type": "house_type",
-                "Num People": "num_people",
-                "Energy Saving": "energy_saving",
-                "Season": "season"
-            }
-        )
+        # Preallocated collector of the agent variables at each step (pass ring=True for unbounded runs)
+        if collector is not None and collector.num_agents != self.num_agents:
+            raise ValueError(f"The collector records {collector.num_agents} agents, the model has {self.num_agents}")
+        self.datacollector = collector if collector is not None else ColumnarCollector(self.num_agents, season)
+        self._house_type_codes = {house_type: code for code, house_type in enumerate(HOUSE_TYPES)}
 
     '''
         Return house type based on number of people
@@ -65,18 +57,27 @@ class HouseholdEnergyModel(Model):
         Collect data at each step of the simulation
     '''
     def step(self):
-        self.schedule.step()
-        # Collect data at each step
-        self.datacollector.collect(self)
+        with instrumentation.phase('abm_step'):
+            self.schedule.step()
+            # Collect data at each step
+            self.datacollector.collect(self.agent_values())
+
+    '''
+        Read the variables of all agents into one array per collector column
+    '''
+    def agent_values(self):
+        agents = self.schedule.agents
+        count = len(agents)
+        return {
+            "Electricity Usage": np.fromiter((agent.electricity_usage for agent in agents), np.float64, count),
+            "Gas Usage": np.fromiter((agent.gas_usage for agent in agents), np.float64, count),
+            "House Type": np.fromiter((self._house_type_codes[agent.house_type] for agent in agents), np.int8, count),
+            "Num People": np.fromiter((agent.num_people for agent in agents), np.int8, count),
+            "Energy Saving": np.fromiter((agent.energy_saving == 'Yes' for agent in agents), np.int8, count),
+        }
 
     '''
-        Collect data from all agents in the model and Return
+        Collect data from all agents in the model and Return it as a DataFrame
     '''
     def collect_data(self):
-        data = []
-        for agent in self.schedule.agents:
-            data.append([
-                agent.house_type, agent.num_people, np.round(agent.electricity_usage, 2),
-                np.round(agent.gas_usage, 2), agent.energy_saving
-            ])
-        return data
+        return household_frame(self.agent_values())
@@ -0,0 +1,22 @@
+# Energy usage parameters annually (kWh) and their standard deviation
+ENERGY_USAGE_PARAMS = {
+    'Flat/1-bedroom': {'electricity': (1800, 270), 'gas': (7500, 1125)},
+    'Medium 2-3 bedroom': {'electricity': (2700, 405), 'gas': (11500, 1725)},
+    '4+ bedroom': {'electricity': (4100, 615), 'gas': (17000, 2550)}
+}
+
+# House types in the order used for categorical codes
+HOUSE_TYPES = list(ENERGY_USAGE_PARAMS)
+
+# Distribution of household sizes
+HOUSEHOLD_SIZES = [1]*29 + [2]*47 + [3]*26 + [4]*23 + [5]*9 + [6]*3
+
+# Share of households that engage in energy savings
+ENERGY_SAVING_PROBABILITY = 0.3
+
+# Energy usage is 36% higher in winter, and 10% lower for households engaged in energy savings
+WINTER_USAGE_FACTOR = 1.36
+ENERGY_SAVING_FACTOR = 0.9
+
+# Energy saving labels in the order used for categorical codes (code 1 means the household saves energy)
+ENERGY_SAVING_LABELS = ['No', 'Yes']
@@ -0,0 +1,126 @@
+import numpy as np
+
+import instrumentation
+
+from models.collector import household_frame
+from models.parameters import (ENERGY_USAGE_PARAMS, HOUSE_TYPES, HOUSEHOLD_SIZES, ENERGY_SAVING_PROBABILITY,
+                               WINTER_USAGE_FACTOR, ENERGY_SAVING_FACTOR)
+
+# Moore neighbourhood offsets, without the centre cell
+NEIGHBOUR_OFFSETS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)],
+                             dtype=np.int16)
+
+
+class HouseholdPopulation:
+    def __init__(self, num_households, season, grid=True, width=10, height=10, seed=None, collector=None):
+        """
+        Columnar (struct-of-arrays) version of HouseholdEnergyModel for very large populations.
+
+        Instead of one mesa agent per household, every attribute is a NumPy array with one entry per household,
+        and all usage draws and grid moves of a step are done in bulk. The statistical model is the same as
+        HouseholdEnergyModel and Household.
+
+        Parameters:
+        - num_households: Number of households. Household sizes are sampled from the size distribution, so any
+          number of households is supported.
+        - season: 'winter' or 'summer'.
+        - grid: If False, households have no position and step() only redraws their usage.
+        - width, height: Size of the (non-toroidal) grid.
+        - seed: Seed for the population's own numpy.random.Generator.
+        - collector: Optional ColumnarCollector that records the households at every step. Nothing is recorded
+          by default, as the history of a very large population does not fit in memory.
+        """
+        self.num_agents = num_households
+        self.season = season
+        self.rng = np.random.default_rng(seed)
+        self.grid = grid
+        self.width = width
+        self.height = height
+        if collector is not None and collector.num_agents != num_households:
+            raise ValueError(f"The collector records {collector.num_agents} agents, the population has "
+                             f"{num_households}")
+        self.datacollector = collector
+
+        # Sample household sizes with the same probabilities as the household_sizes list
+        sizes, counts = np.unique(HOUSEHOLD_SIZES, return_counts=True)
+        self.num_people = self.rng.choice(sizes, size=num_households, p=counts / counts.sum()).astype(np.int8)
+
+        # House type codes index HOUSE_TYPES
+        house_type_of_size = np.array([0, 0, 1, 1, 2, 2, 2], dtype=np.int8)
+        self.house_type = house_type_of_size[np.minimum(self.num_people, 6)]
+        self.energy_saving = self.rng.random(num_households) < ENERGY_SAVING_PROBABILITY
+
+        # Mean and standard deviation of each house type, looked up per household when drawing usage
+        self._usage_params = {
+            energy_type: np.array([ENERGY_USAGE_PARAMS[house_type][energy_type] for house_type in HOUSE_TYPES])
+            for energy_type in ('electricity', 'gas')
+        }
+        usage_factor = np.where(self.energy_saving, ENERGY_SAVING_FACTOR, 1.0)
+        if season == 'winter':
+            usage_factor = usage_factor * WINTER_USAGE_FACTOR
+        self._usage_factor = usage_factor
+
+        self.electricity_usage = self.calculate_energy_usage('electricity')
+        self.gas_usage = self.calculate_energy_usage('gas')
+
+        if grid:
+            self.position = np.stack([self.rng.integers(0, width, num_households),
+                                      self.rng.integers(0, height, num_households)], axis=1).astype(np.int16)
+        else:
+            self.position = None
+
+    def calculate_energy_usage(self, energy_type):
+        """
+        Draw the annual usage of every household at once, as in Household.calculate_energy_usage.
+        """
+        params = self._usage_params[energy_type][self.house_type]
+        usage = self.rng.normal(params[:, 0], params[:, 1])
+        usage *= self._usage_factor
+        return np.maximum(usage, 0)
+
+    def move(self):
+        """
+        Move every household to a random neighbouring cell, chosen uniformly among the cells inside the grid.
+        """
+        candidates = self.position[:, None, :] + NEIGHBOUR_OFFSETS[None, :, :]
+        valid = ((candidates[..., 0] >= 0) & (candidates[..., 0] < self.width) &
+                 (candidates[..., 1] >= 0) & (candidates[..., 1] < self.height))
+        cumulative = np.cumsum(valid, axis=1)
+
+        # Pick the k-th valid neighbour of each household
+        k = (self.rng.random(self.num_agents) * cumulative[:, -1]).astype(cumulative.dtype)
+        choice = np.argmax(cumulative > k[:, None], axis=1)
+        self.position = candidates[np.arange(self.num_agents), choice]
+
+    def step(self):
+        with instrumentation.phase('abm_step'):
+            if self.grid:
+                self.move()
+            self.electricity_usage = self.calculate_energy_usage('electricity')
+            self.gas_usage = self.calculate_energy_usage('gas')
+            if self.datacollector is not None:
+                self.datacollector.collect(self.agent_values())
+
+    def agent_values(self):
+        """
+        Return the household arrays (not copies) by collector column.
+        """
+        return {
+            "Electricity Usage": self.electricity_usage,
+            "Gas Usage": self.gas_usage,
+            "House Type": self.house_type,
+            "Num People": self.num_people,
+            "Energy Saving": self.energy_saving,
+        }
+
+    def house_type_labels(self):
+        return np.array(HOUSE_TYPES)[self.house_type]
+
+    def energy_saving_labels(self):
+        return np.where(self.energy_saving, 'Yes', 'No')
+
+    def collect_data(self):
+        """
+        Return the same table as HouseholdEnergyModel.collect_data.
+        """
+        return household_frame(self.agent_values())
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import time
+
+# Bump when the training code changes in a way that makes previously cached tables invalid
+CACHE_VERSION = 1
+
+# Weights of a different season and of each room of difference in environment_distance, against the relative
+# differences of prices and appliance usage
+SEASON_DISTANCE = 10.0
+ROOMS_DISTANCE = 1.0
+
+
+def training_key(env, agent, episodes, seed, convergence=None, epsilon_decay=1.0, warm_start=None):
+    """
+    Collect everything that determines the outcome of a training run into a JSON-serialisable dict.
+
+    Parameters:
+    - env: EnergyEnvironment the agent is trained in.
+    - agent: QLearningAgent before training.
+    - episodes: Number of training episodes.
+    - seed: Seed of the training run.
+    - convergence: ConvergenceMonitor of an early-stopped run, or None.
+    - epsilon_decay: Per-episode epsilon decay of the run.
+    - warm_start: Hash of the cached table training started from, or None for an all-zeros table.
+
+    Returns:
+    - Dict with the environment parameters (including a hash of the time series, if any), agent
+      hyperparameters, episodes and seed.
+    """
+    key = {
+        'version': CACHE_VERSION,
+        'environment': {
+            'season': env.season,
+            'num_rooms': env.num_rooms,
+            'num_days': env.num_days,
+            'peak_price': env.peak_price,
+            'off_peak_price': env.off_peak_price,
+            'gas_price': env.gas_price,
+            'appliance_usage': env.appliance_usage,
+        },
+        'agent': {
+            'state_size': [int(size) for size in agent.state_size],
+            'action_size': [int(size) for size in agent.action_size],
+            'alpha': agent.alpha,
+            'gamma': agent.gamma,
+            'epsilon': agent.epsilon,
+            'compact': agent.compact,
+            'storage': agent.storage,
+            'dtype': agent.dtype.name,
+        },
+        'episodes': episodes,
+        'seed': seed,
+    }
+    # The learning rule is only added for the multi-step rules, so the keys of one-step tables do not change
+    if agent.update_rule == 'q_lambda':
+        key['agent'].update(update_rule='q_lambda', trace_decay=agent.trace_decay)
+    elif agent.update_rule == 'n_step':
+        key['agent'].update(update_rule='n_step', n_steps=agent.n_steps)
+    if convergence is not None or epsilon_decay != 1.0 or warm_start is not None:
+        # Likewise only added when training deviates from a fixed number of episodes at constant epsilon
+        key['training'] = {
+            'epsilon_decay': epsilon_decay,
+            'convergence': convergence.settings() if convergence is not None else None,
+        }
+        if warm_start is not None:
+            key['training']['warm_start'] = warm_start
+    if env.series is not None:
+        # Only added with a time series, so the keys of tables trained with the fixed tariff do not change
+        key['environment']['series'] = env.series.fingerprint()
+    return key
+
+
+def environment_distance(a, b):
+    """
+    Return how different two environments (the 'environment' parts of training keys) are, for choosing the
+    cached table to warm-start from: the sum of the relative differences of the prices and appliance usages, plus
+    ROOMS_DISTANCE per room and SEASON_DISTANCE for a different season.
+    """
+    distance = SEASON_DISTANCE * (a['season'] != b['season']) + ROOMS_DISTANCE * abs(a['num_rooms'] - b['num_rooms'])
+    pairs = [(a[name], b[name]) for name in ('peak_price', 'off_peak_price', 'gas_price')]
+    appliances = set(a['appliance_usage']) | set(b['appliance_usage'])
+    pairs += [(a['appliance_usage'].get(name, 0), b['appliance_usage'].get(name, 0)) for name in sorted(appliances)]
+    for x, y in pairs:
+        if x != y:
+            distance += abs(x - y) / max(abs(x), abs(y))
+    return distance
+
+
+def _cold_key(key):
+    # The training key of the same run started from an all-zeros table
+    if 'warm_start' not in key.get('training', {}):
+        return key
+    training = {name: value for name, value in key['training'].items() if name != 'warm_start'}
+    return {**key, 'training': training}
+
+
+def key_hash(key):
+    """
+    Hash a training key into the cache file name.
+    """
+    canonical = json.dumps(key, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+class PolicyCache:
+    def __init__(self, directory='data/policy_cache'):
+        """
+        Content-addressed store of trained Q-tables.
+
+        Each table is saved as <hash>.npy (in the layout written by QLearningAgent.save_q_table) next to a
+        <hash>.json metadata file holding the full training key, so an entry whose metadata no longer matches
+        the key (an old cache version or a corrupted entry) is treated as stale.
+
+        Parameters:
+        - directory: Directory holding the cached tables.
+        """
+        self.directory = directory
+
+    def _paths(self, key):
+        digest = key_hash(key)
+        return os.path.join(self.directory, f"{digest}.npy"), os.path.join(self.directory, f"{digest}.json")
+
+    def lookup(self, key):
+        """
+        Return the path of the cached table for key, or None on a miss or a stale entry.
+        """
+        table_path, metadata_path = self._paths(key)
+        if not (os.path.exists(table_path) and os.path.exists(metadata_path)):
+            return None
+        try:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None  # Removed since the check, or corrupted: treat as a miss and retrain
+        # Round-trip the key through JSON so it compares equal to the stored one
+        if metadata.get('key') != json.loads(json.dumps(key)):
+            return None
+        return table_path
+
+    def metadata(self, key):
+        """
+        Return the metadata stored with the table for key (including the extra values passed to `store`), or
+        None if it cannot be read.
+        """
+        _, metadata_path = self._paths(key)
+        try:
+            with open(metadata_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def nearest(self, key):
+        """
+        Find the cached table trained in the environment closest to key's (see environment_distance), to
+        warm-start training from.
+
+        Only tables of the same cache version, state and action sizes and time series qualify. Entries of key
+        itself, cold or warm-started, are skipped, so repeating a warm-started run picks the same table to start
+        from and finds its own result in the cache.
+
+        Returns:
+        - (hash, metadata, distance) of the closest entry, or None if there is none.
+        """
+        if not os.path.isdir(self.directory):
+            return None
+        key = json.loads(json.dumps(key))
+        best = None
+        for name in sorted(os.listdir(self.directory)):
+            candidate, extension = os.path.splitext(name)
+            if extension != '.json':
+                continue
+            if not os.path.exists(os.path.join(self.directory, f"{candidate}.npy")):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    metadata = json.load(f)
+                cached = metadata['key']
+                if _cold_key(cached) == key:
+                    continue
+                if (cached['version'] != key['version'] or
+                        cached['agent']['state_size'] != key['agent']['state_size'] or
+                        cached['agent']['action_size'] != key['agent']['action_size'] or
+                        cached['environment'].get('series') != key['environment'].get('series')):
+                    continue
+                distance = environment_distance(key['environment'], cached['environment'])
+            except (ValueError, KeyError):
+                continue  # Corrupted or foreign metadata
+            if best is None or distance < best[2]:
+                best = (candidate, metadata, distance)
+        return best
+
+    def load(self, key, agent):
+        """
+        Load the cached table for key into agent, memory-mapped (copy-on-write, the file is never modified).
+
+        Returns:
+        - True on a hit, False on a miss or a stale entry.
+        """
+        table_path = self.lookup(key)
+        if table_path is None:
+            return False
+        try:
+            agent.load_q_table(table_path, mmap_mode='c')
+        except ValueError:
+            # The table does not fit the agent, treat it as stale
+            return False
+        return True
+
+    def store(self, key, agent, **extra):
+        """
+        Save the agent's Q-table and its metadata for key. Extra keyword arguments are added to the metadata.
+
+        Both files are written next to their paths and renamed over them, table first, so a crash never leaves a
+        truncated entry and an entry's metadata only appears once its table is complete.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        table_path, metadata_path = self._paths(key)
+        temporary_path = f"{table_path[:-len('.npy')]}.tmp.npy"  # save_q_table adds .npy to other names
+        agent.save_q_table(temporary_path)
+        os.replace(temporary_path, table_path)
+        metadata = {'key': key, 'created': time.time(), 'shape': [int(size) for size in agent.q_table.shape]}
+        metadata.update(extra)
+        temporary_path = f"{metadata_path}.tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(metadata, f, indent=2, sort_keys=True)
+        os.replace(temporary_path, metadata_path)
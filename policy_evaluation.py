@@ -0,0 +1,489 @@
+import hashlib
+import warnings
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+
+from encoding import encode, decode
+from energy_environment import EnergyEnvironment
+
+# Trial-hours of switch states drawn at a time by the Monte Carlo evaluation with a time series
+MONTE_CARLO_CHUNK = 2 ** 20
+
+# Switches drawn by the random policy (the fridge is always on)
+RANDOM_SWITCHES = [0, 1, 3, 4]
+
+# Result of check_vectorised_draws, once evaluate_policy has run it
+_VECTORISED_DRAWS_OK = None
+
+
+@dataclass
+class PolicyEvaluation:
+    """
+    Result of evaluating a policy over the whole horizon.
+
+    Totals are in kWh and £, the hourly_* arrays hold the per-hour breakdown (one entry per simulated hour) and
+    records the environment's usage record of every hour (see energy_environment.STEP_RECORD).
+    """
+    electricity: float
+    gas: float
+    cost: float
+    hourly_electricity: np.ndarray
+    hourly_gas: np.ndarray
+    hourly_cost: np.ndarray
+    actions: np.ndarray
+    records: np.ndarray = None
+
+    def totals(self):
+        """
+        Return (total electricity, total gas, total cost), the tuple returned by the EnergyModel test methods.
+        """
+        return self.electricity, self.gas, self.cost
+
+
+class GreedyPolicy:
+    def __init__(self, q_table, epsilon=0.0, action_size=(2, 2, 2, 2, 2), packed_exploration=False):
+        """
+        Epsilon-greedy policy over a Q-table, drawing from np.random exactly like QLearningAgent.choose_action.
+
+        Parameters:
+        - q_table: Q-table in either the multidimensional or the compact (num_states, num_actions) layout.
+        - epsilon: Exploration rate of the agent.
+        - action_size: Size of each action dimension.
+        - packed_exploration: True if exploration draws one packed action index (compact agents) instead of
+          one value per action dimension.
+        """
+        self.action_size = list(action_size)
+        self.num_actions = int(np.prod(self.action_size))
+        self.q_table = np.asarray(q_table).reshape(-1, self.num_actions)
+        self.epsilon = epsilon
+        self.packed_exploration = packed_exploration
+
+    @classmethod
+    def from_agent(cls, agent):
+        return cls(agent.q_table, agent.epsilon, agent.action_size, packed_exploration=agent.compact)
+
+    def fingerprint(self):
+        """
+        Return a string identifying this policy: a hash of the Q-table plus the exploration settings.
+        """
+        digest = hashlib.sha1(np.ascontiguousarray(self.q_table).tobytes()).hexdigest()
+        return f"greedy:{digest}:{self.q_table.dtype}:{self.epsilon!r}:{self.action_size}:{self.packed_exploration}"
+
+    def set_season(self, season):
+        pass  # The Q-table does not depend on the season
+
+    def actions(self, env, steps, cold=None):
+        """
+        Draw the whole (steps, 5) action sequence of an episode in env. The greedy policy does not depend on
+        the cold hours, `cold` is accepted for the same interface as RandomPolicy.
+
+        The random stream is consumed exactly as `steps` calls to choose_action would: two 32-bit words for
+        the exploration draw, plus the words of the random action when exploring.
+        """
+        for size in self.action_size:
+            if size & (size - 1):
+                raise ValueError("Exact replay of exploration draws needs power-of-two action sizes")
+
+        explore_words = 1 if self.packed_exploration else len(self.action_size)
+
+        # Draw enough words for the worst case, then find where each step starts reading from them
+        state = np.random.get_state()
+        words = _draw_words((2 + explore_words) * steps + 2)
+        uniforms = _uniforms(words[:-1], words[1:])
+        explore = uniforms < self.epsilon
+        jump = np.arange(len(words)) + np.where(np.append(explore, False), 2 + explore_words, 2)
+        positions = _orbit(jump, 0, steps + 1)
+        explore = explore[positions[:-1]]
+
+        # Rewind and consume exactly as many words as the loop would have
+        np.random.set_state(state)
+        _draw_words(positions[-1])
+
+        # Random actions of the exploration steps
+        start = positions[:-1] + 2
+        if self.packed_exploration:
+            random_actions = words[start] & np.uint32(self.num_actions - 1)
+        else:
+            offsets = start[:, None] + np.arange(len(self.action_size))
+            masks = np.array(self.action_size, dtype=np.uint32) - 1
+            random_actions = encode(words[offsets] & masks, self.action_size)
+
+        # Greedy action of every state, as argmax over the flattened Q-values of that state
+        greedy_actions = self.q_table.argmax(axis=1)
+        next_state = env.transition_table[0]
+
+        # Between two exploration steps the state follows the greedy transitions, so the state at time t is the
+        # state reached after the last exploration step, advanced along its greedy orbit
+        greedy_orbits = _orbit(next_state[greedy_actions], np.arange(len(greedy_actions)), steps)
+        time = np.arange(steps)
+        anchor_time = np.maximum.accumulate(np.where(explore, time + 1, 0))[:-1]
+        anchor_time = np.concatenate([[0], anchor_time])
+        anchor_state = np.concatenate([[env.state_index], np.where(explore, next_state[random_actions], 0)[:-1]])
+        states = greedy_orbits[anchor_state[anchor_time], time - anchor_time]
+
+        action_index = np.where(explore, random_actions, greedy_actions[states])
+        return decode(action_index, self.action_size)
+
+
+    def loop_actions(self, env, steps, cold=None):
+        """
+        Per-hour reference of `actions`: draw one hour at a time as QLearningAgent.choose_action does.
+        """
+        actions = np.zeros((steps, len(self.action_size)), dtype=np.int64)
+        next_state = env.transition_table[0]
+        state = env.state_index
+        for hour in range(steps):
+            if np.random.rand() < self.epsilon:
+                if self.packed_exploration:
+                    action_index = np.random.randint(self.num_actions)
+                else:
+                    action_index = encode([np.random.randint(size) for size in self.action_size], self.action_size)
+            else:
+                action_index = self.q_table[state].argmax()
+            actions[hour] = decode(action_index, self.action_size)
+            state = next_state[action_index]
+        return actions
+
+
+class RandomPolicy:
+    def __init__(self, season):
+        """
+        Random baseline policy, drawing from np.random exactly like EnergyModel's random policy loop.
+
+        Lights and washing machine are switched on with probability 1/2, the fridge is always on, gas heating
+        is used in winter only (10% at cold hours, 20% otherwise) and cooking happens around meal times (20%).
+        """
+        self.season = season
+
+    def fingerprint(self):
+        return f"random:{self.season}"
+
+    def switch_probabilities(self, hours=None, cold=None):
+        """
+        Return the (len(hours), 5) probabilities of each switch being on at the given hours of an episode.
+
+        Parameters:
+        - hours: Hours since the start of the episode. Defaults to the 24 hours of a day.
+        - cold: Optional boolean array marking the cold hours among `hours`, e.g. from a temperature series.
+          Defaults to the early morning and late evening hours.
+        """
+        hours = np.arange(24) if hours is None else np.asarray(hours) % 24
+        probabilities = np.zeros((len(hours), 5))
+        probabilities[:, 0] = 0.5
+        probabilities[:, 1] = 0.5
+        probabilities[:, 2] = 1.0  # Fridge is always on
+        if self.season == 'winter':
+            cold_hour = default_cold_hours(hours) if cold is None else cold
+            probabilities[:, 3] = np.where(cold_hour, 0.1, 0.2)
+        cooking_hour = ((7 <= hours) & (hours < 9)) | ((17 <= hours) & (hours < 19))
+        probabilities[:, 4] = np.where(cooking_hour, 0.2, 0.0)
+        return probabilities
+
+    def set_season(self, season):
+        self.season = season
+
+    def actions(self, env, steps, cold=None):
+        """
+        Draw the whole (steps, 5) action sequence of an episode in env.
+
+        Parameters:
+        - cold: Optional (steps,) boolean array of cold hours, e.g. from a temperature series. Defaults to the
+          early morning and late evening hours.
+        """
+        hours = np.arange(steps) % 24
+        winter = self.season == 'winter'
+        cooking_hour = ((7 <= hours) & (hours < 9)) | ((17 <= hours) & (hours < 19))
+
+        # 32-bit words used per hour: 1 per coin flip, 2 per weighted draw
+        words_per_hour = 2 + (2 if winter else 0) + np.where(cooking_hour, 2, 0)
+        offsets = np.cumsum(words_per_hour) - words_per_hour
+        words = _draw_words(int(words_per_hour.sum()))
+
+        actions = np.zeros((steps, 5), dtype=np.int64)
+        actions[:, 0] = words[offsets] & 1
+        actions[:, 1] = words[offsets + 1] & 1
+        actions[:, 2] = 1  # Assume fridge is always on
+
+        if winter:
+            cold_hour = default_cold_hours(hours) if cold is None else cold
+            heating = _uniforms(words[offsets + 2], words[offsets + 3])
+            actions[:, 3] = np.where(cold_hour, heating >= _threshold([0.9, 0.1]), heating >= _threshold([0.8, 0.2]))
+
+        cooking_offsets = offsets + (4 if winter else 2)
+        cooking_offsets = np.where(cooking_hour, cooking_offsets, 0)
+        cooking = _uniforms(words[cooking_offsets], words[cooking_offsets + 1])
+        actions[:, 4] = cooking_hour & (cooking >= _threshold([0.8, 0.2]))
+        return actions
+
+
+    def loop_actions(self, env, steps, cold=None):
+        """
+        Per-hour reference of `actions`: draw one hour at a time as EnergyModel's random policy loop did.
+        """
+        hours = np.arange(steps) % 24
+        cold_hour = default_cold_hours(hours) if cold is None else cold
+        actions = np.zeros((steps, 5), dtype=np.int64)
+        for step, hour in enumerate(hours):
+            actions[step, 0] = np.random.choice([0, 1])
+            actions[step, 1] = np.random.choice([0, 1])
+            actions[step, 2] = 1  # Assume fridge is always on
+            if self.season == 'winter':
+                actions[step, 3] = np.random.choice([0, 1], p=[0.9, 0.1] if cold_hour[step] else [0.8, 0.2])
+            if 7 <= hour < 9 or 17 <= hour < 19:
+                actions[step, 4] = np.random.choice([0, 1], p=[0.8, 0.2])
+        return actions
+
+
+def check_vectorised_draws(seeds=(0, 1, 2), days=3):
+    """
+    Check that the vectorised `actions` of the policies still draw exactly what their per-hour `loop_actions`
+    draw, and leave np.random at the same point of its stream.
+
+    The vectorised draws decode the 32-bit word stream of NumPy's legacy MT19937 generator the way
+    np.random.rand, randint and choice do, which is a NumPy implementation detail. Compared for the given
+    seeds in both seasons, for an exploring GreedyPolicy (per-dimension and packed exploration) and the
+    RandomPolicy. The global random state is restored afterwards.
+
+    Returns:
+    - True if every action sequence and final stream position match.
+    """
+    rng_state = np.random.get_state()
+    try:
+        q_table = np.random.RandomState(0).rand(32, 32)
+        policies = [GreedyPolicy(q_table, epsilon=0.3), GreedyPolicy(q_table, epsilon=0.3, packed_exploration=True)]
+        for season in ('winter', 'summer'):
+            env = EnergyEnvironment(season=season, precompute=True)
+            cold = default_cold_hours(np.arange(days * 24)) ^ (np.arange(days * 24) % 5 == 0)
+            for policy, policy_cold in [(policy, None) for policy in policies] + [(RandomPolicy(season), cold)]:
+                for seed in seeds:
+                    results = []
+                    for draw in (policy.actions, policy.loop_actions):
+                        np.random.seed(seed)
+                        results.append((draw(env, days * 24, policy_cold), np.random.get_state()[1:3]))
+                    (vectorised, vectorised_state), (loop, loop_state) = results
+                    if not (np.array_equal(vectorised, loop) and np.array_equal(vectorised_state[0], loop_state[0])
+                            and vectorised_state[1] == loop_state[1]):
+                        return False
+        return True
+    finally:
+        np.random.set_state(rng_state)
+
+
+def _vectorised_draws_ok():
+    # check_vectorised_draws, run once per process
+    global _VECTORISED_DRAWS_OK
+    if _VECTORISED_DRAWS_OK is None:
+        _VECTORISED_DRAWS_OK = check_vectorised_draws()
+        if not _VECTORISED_DRAWS_OK:
+            warnings.warn("The vectorised policy draws no longer match NumPy's np.random stream; evaluate_policy "
+                          "falls back to the per-hour loops", RuntimeWarning)
+    return _VECTORISED_DRAWS_OK
+
+
+def switch_decomposition(table, sizes):
+    """
+    Split per-action values into the value of the action with only the fridge on and the extra value of turning
+    on each RANDOM_SWITCHES switch as well.
+
+    Usage and cost are linear in the switches, so the value of any action of the random policy is the base value
+    plus the extra values of its switches that are on.
+
+    Parameters:
+    - table: Array of values with the packed action index along its last axis, e.g. electricity_usage_table or
+      rows of rewards.
+    - sizes: Sizes of the action dimensions.
+
+    Returns:
+    - (base, extra): the (...,) values of the fridge-only action and the (..., len(RANDOM_SWITCHES)) extra values.
+    """
+    base_action = np.array([0, 0, 1, 0, 0])
+    switch_actions = np.tile(base_action, (len(RANDOM_SWITCHES), 1))
+    switch_actions[np.arange(len(RANDOM_SWITCHES)), RANDOM_SWITCHES] = 1
+    base_index = encode(base_action, sizes)
+    switch_index = encode(switch_actions, sizes)
+    table = np.asarray(table)
+    return table[..., base_index], table[..., switch_index] - table[..., [base_index]]
+
+
+def default_cold_hours(hours):
+    # Without a temperature series, assume colder usage in early mornings and late evenings
+    return (hours < 7) | (hours >= 19)
+
+
+def evaluate_policy(policy, num_rooms, season, days=None, series=None, tariff=None):
+    """
+    Evaluate a policy for `days` days with array operations instead of a per-hour loop.
+
+    The policy's actions are drawn exactly as the original loops of EnergyModel.test_agent_exploitation and
+    EnergyModel.test_random_policy drew them, so for the same np.random seed they are identical. The first call
+    verifies this against the per-hour loops (check_vectorised_draws) and, should a NumPy version ever draw
+    differently, warns and uses the loops instead. The usage and cost of every hour are the environment's own
+    step records (EnergyEnvironment.records), aggregated as they are, so the evaluation agrees with the rewards
+    the agent was trained on. Totals are accumulated in order.
+
+    Parameters:
+    - policy: A GreedyPolicy or RandomPolicy.
+    - num_rooms: Number of rooms of the house.
+    - season: 'winter' or 'summer'.
+    - days: Number of days to simulate. Defaults to 90, or to the whole series.
+    - series: Optional EnergyTimeSeries with the hourly prices and cold hours. Only the evaluated hours are read.
+    - tariff: Optional prices overriding the environment's fixed tariff (see EnergyEnvironment).
+
+    Returns:
+    - PolicyEvaluation with totals and per-hour breakdown.
+    """
+    env = EnergyEnvironment(num_rooms=num_rooms, season=season, precompute=True, series=series, tariff=tariff)
+    policy.set_season(season)
+    steps = days * 24 if days is not None else env.num_hours
+    if steps > env.num_hours:
+        raise ValueError(f"The series covers {env.num_hours} hours, {steps} were asked for")
+    cold = series.cold_hours(0, steps) if series is not None else None
+
+    draw = policy.actions if _vectorised_draws_ok() else policy.loop_actions
+    actions = draw(env, steps, cold)
+    records = env.records(encode(actions, list(env.action_space.nvec)))
+    cost = records['electricity_cost'] + records['gas_cost']
+
+    return PolicyEvaluation(
+        electricity=_running_total(records['electricity']),
+        gas=_running_total(records['gas']),
+        cost=_running_total(cost),
+        hourly_electricity=records['electricity'],
+        hourly_gas=records['gas'],
+        hourly_cost=cost,
+        actions=actions,
+        records=records,
+    )
+
+
+@dataclass
+class MonteCarloEvaluation:
+    """
+    Totals of many independent trials of a random policy, one entry per trial.
+    """
+    electricity: np.ndarray
+    gas: np.ndarray
+    cost: np.ndarray
+    confidence: float
+
+    def summary(self):
+        """
+        Return the mean, standard deviation, confidence interval of the mean and the central interval holding
+        `confidence` of the trials, for each of electricity, gas and cost.
+        """
+        z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+        tail = (1 - self.confidence) / 2 * 100
+        summary = {}
+        for name in ('electricity', 'gas', 'cost'):
+            values = getattr(self, name)
+            mean = float(values.mean())
+            std = float(values.std(ddof=1)) if len(values) > 1 else 0.0
+            half_width = z * std / np.sqrt(len(values))
+            low, high = np.percentile(values, [tail, 100 - tail])
+            summary[name] = {'mean': mean, 'std': std, 'ci_low': mean - half_width, 'ci_high': mean + half_width,
+                             'interval_low': float(low), 'interval_high': float(high)}
+        return summary
+
+
+def evaluate_random_policy_monte_carlo(num_rooms, season, trials=10000, days=None, seed=None, confidence=0.95,
+                                       series=None, tariff=None):
+    """
+    Evaluate the random policy over many independent trials at once.
+
+    Every hour's electricity, gas and cost are linear in the on/off switches, so a trial's totals only depend on
+    which switches were on at which hours. With the fixed tariff the hours of day repeat every day, so only how
+    many days each switch was on at each hour of day matters. Those counts are drawn directly, as
+    Binomial(days, p[hour, switch]) with the random policy's hour-dependent probabilities, for all trials in one
+    call of a numpy.random.Generator. This has the same distribution as simulating every hour of every trial.
+    With a time series every hour has its own price and cold-hour probability, so the switches of every hour
+    are drawn, MONTE_CARLO_CHUNK trial-hours at a time.
+
+    Parameters:
+    - num_rooms: Number of rooms of the house.
+    - season: 'winter' or 'summer'.
+    - trials: Number of independent trials.
+    - days: Number of days per trial. Defaults to 90, or to the whole series.
+    - seed: Seed (or SeedSequence) of the generator.
+    - confidence: Confidence level of the reported intervals.
+    - series: Optional EnergyTimeSeries with the hourly prices and cold hours, as in evaluate_policy.
+    - tariff: Optional prices overriding the environment's fixed tariff (see EnergyEnvironment).
+
+    Returns:
+    - MonteCarloEvaluation with the totals of every trial.
+    """
+    rng = np.random.default_rng(seed)
+    env = EnergyEnvironment(num_rooms=num_rooms, season=season, precompute=True, series=series, tariff=tariff)
+    steps = days * 24 if days is not None else env.num_hours
+    if steps > env.num_hours:
+        raise ValueError(f"The series covers {env.num_hours} hours, {steps} were asked for")
+    policy = RandomPolicy(season)
+    sizes = list(env.action_space.nvec)
+
+    # Usage and cost of every action at every hour (of day, with the fixed tariff), as recorded by the environment,
+    # split into the value with only the fridge on and the extra value of each other switch
+    periods = 24 if series is None else steps
+    base, extra = {}, {}
+    for name in ('electricity', 'gas'):
+        usage_base, usage_extra = switch_decomposition(getattr(env, f"{name}_usage_table"), sizes)
+        base[name] = np.full(periods, usage_base)
+        extra[name] = np.tile(usage_extra, (periods, 1))
+    base['cost'], extra['cost'] = switch_decomposition(-env.reward_rows(0, periods), sizes)
+
+    if series is None:
+        # (trials, 24, switches) number of days each switch was on at each hour
+        days = steps // 24
+        counts = rng.binomial(days, policy.switch_probabilities()[:, RANDOM_SWITCHES],
+                              size=(trials, 24, len(RANDOM_SWITCHES)))
+        totals = {name: days * base[name].sum() + np.einsum('khs,hs->k', counts, extra[name])
+                  for name in base}
+    else:
+        probabilities = policy.switch_probabilities(np.arange(steps), series.cold_hours(0, steps))[:, RANDOM_SWITCHES]
+        totals = {name: np.full(trials, base[name].sum()) for name in base}
+        chunk = max(1, MONTE_CARLO_CHUNK // steps)
+        for start in range(0, trials, chunk):
+            stop = min(start + chunk, trials)
+            # (chunk trials, hours, switches) switch states
+            on = rng.random((stop - start, steps, len(RANDOM_SWITCHES))) < probabilities
+            for name in totals:
+                totals[name][start:stop] += np.einsum('khs,hs->k', on, extra[name])
+    return MonteCarloEvaluation(totals['electricity'], totals['gas'], totals['cost'], confidence)
+
+
+def _running_total(values):
+    # Sequential sum (rather than np.sum's pairwise sum) so totals match a Python accumulation loop exactly
+    return float(np.cumsum(values)[-1]) if len(values) else 0.0
+
+
+def _draw_words(count):
+    # Raw 32-bit outputs of the global legacy generator; each one consumes exactly one word of the stream
+    return np.random.randint(0, 2 ** 32, size=count, dtype=np.uint32)
+
+
+def _uniforms(first, second):
+    # np.random.rand() builds a double from two consecutive 32-bit words
+    first = first.astype(np.int64) >> 5
+    second = second.astype(np.int64) >> 6
+    return (first * 67108864.0 + second) / 9007199254740992.0
+
+
+def _threshold(p):
+    # np.random.choice([0, 1], p=p) returns 1 once the uniform draw reaches the first cdf value
+    cdf = np.array(p, dtype=float).cumsum()
+    cdf /= cdf[-1]
+    return cdf[0]
+
+
+def _orbit(jump, start, length):
+    """
+    Return [start, jump[start], jump[jump[start]], ...] (`length` entries) using pointer doubling.
+
+    start may also be an array of start values, in which case one orbit is returned per value along the last axis.
+    """
+    jump = np.minimum(jump, len(jump) - 1)
+    orbit = np.asarray(start)[..., None]
+    while orbit.shape[-1] < length:
+        orbit = np.concatenate([orbit, jump[orbit]], axis=-1)
+        jump = jump[jump]
+    return orbit[..., :length]
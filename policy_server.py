@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import sys
+import zipfile
+
+import numpy as np
+
+from encoding import encode, decode
+
+# Request: policy name length (uint8), policy name, number of states N (uint32), N packed state indices (int32).
+# Response: status (uint8, 0 = ok), N (uint32), N packed action indices (int32); or on error status 1, the
+# message length (uint32) and the UTF-8 message. All integers are little-endian.
+REQUEST_HEADER = struct.Struct('<B')
+COUNT = struct.Struct('<I')
+RESPONSE_HEADER = struct.Struct('<BI')
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+EXPORT_SUFFIX = '.policy.npz'
+
+
+def compile_policy(q_table, state_size, action_size):
+    """
+    Compile a Q-table into its greedy action lookup array.
+
+    Parameters:
+    - q_table: Q-table in either the multidimensional or the compact (num_states, num_actions) layout (or a
+      SparseQTable).
+    - state_size, action_size: Sizes of the state and action dimensions.
+
+    Returns:
+    - (num_states,) array with the packed greedy action of every packed state index, in the smallest unsigned
+      dtype that holds the action indices. Ties go to the lowest index, as in QLearningAgent.choose_action.
+    """
+    num_states = int(np.prod(state_size))
+    num_actions = int(np.prod(action_size))
+    q_values = np.asarray(q_table).reshape(num_states, num_actions)
+    return q_values.argmax(axis=1).astype(np.min_scalar_type(num_actions - 1))
+
+
+def export_policy(agent, path):
+    """
+    Write the greedy action table of a QLearningAgent to path (an .npz file, see EXPORT_SUFFIX).
+
+    The file is written next to path and renamed over it, so a server watching the file never reads a
+    partially written table.
+    """
+    actions = compile_policy(agent.q_table, agent.state_size, agent.action_size)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as f:
+        np.savez(f, actions=actions, state_size=np.array(agent.state_size), action_size=np.array(agent.action_size))
+    os.replace(temporary_path, path)
+    return actions
+
+
+class PolicyTable:
+    def __init__(self, actions, state_size, action_size):
+        """
+        A compiled greedy policy: looking up the actions of many states is one array indexing operation.
+        """
+        self.actions = actions
+        self.state_size = [int(size) for size in state_size]
+        self.action_size = [int(size) for size in action_size]
+        self.num_states = len(actions)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            return cls(archive['actions'], archive['state_size'], archive['action_size'])
+
+    def lookup(self, state_indices):
+        """
+        Return the packed greedy actions of an array of packed state indices.
+        """
+        return self.actions[state_indices]
+
+    def choose_actions(self, states):
+        """
+        Return the (N, len(action_size)) greedy actions of an (N, len(state_size)) array of states.
+        """
+        return decode(self.lookup(encode(states, self.state_size)), self.action_size)
+
+
+class PolicyServer:
+    def __init__(self, directory, reload_interval=1.0):
+        """
+        Serve the greedy actions of the exported policies in a directory over a Unix or TCP socket.
+
+        Every <name>.policy.npz file in the directory is served as policy <name>. The directory is polled every
+        `reload_interval` seconds and new or changed exports replace the served table between requests, so
+        policies can be retrained and re-exported without restarting the server.
+
+        Parameters:
+        - directory: Directory of the exported policies.
+        - reload_interval: Seconds between checks for changed exports.
+        """
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.policies = {}  # name -> PolicyTable
+        self._mtimes = {}  # name -> modification time of the loaded export
+        self.reload()
+
+    def reload(self):
+        """
+        Load new and changed exports and drop removed ones. Returns the names of the (re)loaded policies.
+        """
+        found = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(EXPORT_SUFFIX):
+                try:
+                    found[entry.name[:-len(EXPORT_SUFFIX)]] = (entry.path, entry.stat().st_mtime_ns)
+                except OSError:
+                    continue  # Removed since the scan
+
+        loaded = []
+        for name, (path, mtime) in found.items():
+            if self._mtimes.get(name) == mtime:
+                continue
+            try:
+                table = PolicyTable.load(path)
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                continue  # Keep serving the previous table; the file is retried at the next check
+            self.policies[name] = table
+            self._mtimes[name] = mtime
+            loaded.append(name)
+        for name in set(self.policies) - set(found):
+            del self.policies[name]
+            del self._mtimes[name]
+        return loaded
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                self.reload()
+            except Exception as error:
+                # Keep watching: the directory may be back, or the export rewritten, at the next check
+                print(f"Policy reload failed: {error!r}", file=sys.stderr)
+
+    def answer(self, name, payload):
+        """
+        Build the response to one request: the packed actions of the packed states in payload.
+        """
+        table = self.policies.get(name)
+        if table is None:
+            return self._error(f"Unknown policy {name!r}")
+        state_indices = np.frombuffer(payload, dtype='<i4')
+        if len(state_indices) and (state_indices.min() < 0 or state_indices.max() >= table.num_states):
+            return self._error(f"State indices must be in range({table.num_states})")
+        actions = table.lookup(state_indices).astype('<i4')
+        return RESPONSE_HEADER.pack(STATUS_OK, len(actions)) + actions.tobytes()
+
+    @staticmethod
+    def _error(message):
+        message = message.encode()
+        return RESPONSE_HEADER.pack(STATUS_ERROR, len(message)) + message
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                name_length, = REQUEST_HEADER.unpack(await reader.readexactly(REQUEST_HEADER.size))
+                # Undecodable bytes become U+FFFD, so an invalid name gets the unknown-policy error response
+                name = (await reader.readexactly(name_length)).decode(errors='replace')
+                count, = COUNT.unpack(await reader.readexactly(COUNT.size))
+                payload = await reader.readexactly(4 * count)
+                writer.write(self.answer(name, payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, unix_path=None, host='127.0.0.1', port=8765):
+        """
+        Serve until cancelled, on the Unix socket unix_path if given, otherwise on host:port.
+        """
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+            # Requests are small, send responses straight away
+            for listening_socket in server.sockets:
+                listening_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        watcher = asyncio.create_task(self._watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+class PolicyClient:
+    def __init__(self, unix_path=None, host='127.0.0.1', port=8765):
+        """
+        Blocking client of a PolicyServer.
+        """
+        if unix_path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(unix_path)
+        else:
+            self.socket = socket.create_connection((host, port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.socket.makefile('rb')
+
+    def lookup(self, name, state_indices):
+        """
+        Return the packed greedy actions of policy `name` for an array of packed state indices.
+        """
+        state_indices = np.ascontiguousarray(state_indices, dtype='<i4')
+        name = name.encode()
+        self.socket.sendall(REQUEST_HEADER.pack(len(name)) + name + COUNT.pack(len(state_indices)) +
+                            state_indices.tobytes())
+        status, count = RESPONSE_HEADER.unpack(self._file.read(RESPONSE_HEADER.size))
+        if status != STATUS_OK:
+            raise ValueError(self._file.read(count).decode())
+        return np.frombuffer(self._file.read(4 * count), dtype='<i4')
+
+    def close(self):
+        self._file.close()
+        self.socket.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve exported greedy policies over a Unix or TCP socket")
+    parser.add_argument('directory', help=f"Directory of <name>{EXPORT_SUFFIX} exports")
+    parser.add_argument('--unix', help="Unix socket path (default: TCP on --host/--port)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--reload-interval', type=float, default=1.0, help="Seconds between checks for new exports")
+    args = parser.parse_args(argv)
+
+    server = PolicyServer(args.directory, args.reload_interval)
+    print(f"Serving {sorted(server.policies)} on {args.unix or f'{args.host}:{args.port}'}")
+    try:
+        asyncio.run(server.serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
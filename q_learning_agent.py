@@ -1,8 +1,19 @@
 import numpy as np
 
+from encoding import radix_weights, encode, decode
+from q_storage import SparseQTable
+import instrumentation
+
+# Learning rules of learn / learn_index: one-step Q-learning, Watkins's Q(lambda) and n-step Q-learning
+UPDATE_RULES = ['q', 'q_lambda', 'n_step']
+
+# Eligibility traces that decay below this are dropped
+TRACE_THRESHOLD = 1e-4
+
 
 class QLearningAgent:
-    def __init__(self, state_size, action_size, alpha=0.1, gamma=0.95, epsilon=0.05):
+    def __init__(self, state_size, action_size, alpha=0.1, gamma=0.95, epsilon=0.05, compact=False, storage='dense',
+                 dtype=np.float64, update_rule='q', trace_decay=0.9, n_steps=4):
         """
         Initialize the Q-learning agent.
 
@@ -13,15 +24,59 @@ class QLearningAgent:
         - alpha: Learning rate (how fast the agent updates Q-values).
         - gamma: Discount factor (how much future rewards are considered).
         - epsilon: Exploration rate (probability of taking a random action).
+        - compact: If True, store the Q-table as a 2-D (num_states, num_actions) array and address it with
+          integer codes packed from the state and action vectors. This avoids the tuple indexing, flatten and
+          unravel_index work of the multidimensional table on every call. Saved files keep the
+          multidimensional layout in both modes, so they can be loaded by either.
+        - storage: 'dense' for a NumPy array, or 'sparse' for a SparseQTable that only allocates the rows of
+          visited states, for large state encodings (e.g. with hour of day, temperature band and occupancy added
+          to the state). Sparse storage always uses the packed indices of compact mode and is saved as .npz.
+        - dtype: dtype of the Q-values, e.g. np.float32 to halve the memory of a dense table.
+        - update_rule: Rule applied by learn and learn_index (see UPDATE_RULES). The state has no clock, so
+          one-step Q-learning ('q') only moves the value of time-of-day dependent rewards back one step per
+          visit. 'q_lambda' (Watkins's Q(lambda)) updates every state-action pair of the recent greedy path with
+          each TD error, weighted by its eligibility trace. 'n_step' updates a pair once its n-step return,
+          r_t + gamma r_t+1 + ... + gamma^n max_a Q(s_t+n, a), is known. Both need dense storage, and the
+          training loops call start_episode and end_episode around every episode. learn_batch always applies
+          the one-step rule.
+        - trace_decay: lambda of Q(lambda); traces decay by gamma * lambda per step.
+        - n_steps: Number of rewards in the n-step return.
         """
         self.state_size = state_size
         self.action_size = action_size
         self.alpha = alpha  # Learning rate
         self.gamma = gamma  # Discount factor
         self.epsilon = epsilon  # Exploration rate
+        if storage not in ('dense', 'sparse'):
+            raise ValueError("storage must be 'dense' or 'sparse'")
+        self.storage = storage
+        self.dtype = np.dtype(dtype)
+        self.compact = compact or storage == 'sparse'
+        self.num_states = int(np.prod(state_size))
+        self.num_actions = int(np.prod(action_size))
+        if update_rule not in UPDATE_RULES:
+            raise ValueError(f"update_rule must be one of {UPDATE_RULES}")
+        if update_rule != 'q' and storage == 'sparse':
+            raise ValueError("The q_lambda and n_step rules need dense storage")
+        self.update_rule = update_rule
+        self.trace_decay = trace_decay
+        self.n_steps = n_steps
 
-        # Initialize Q-table with zeros. The shape of the Q-table is state_size + action_size.
-        self.q_table = np.zeros(state_size + action_size)
+        if self.compact:
+            # Place values for packing state/action vectors into row/column indices, and the
+            # precomputed action vector for every action index
+            self._state_weights = radix_weights(state_size)
+            self._action_weights = radix_weights(action_size)
+            self._action_vectors = [tuple(action) for action in
+                                    decode(np.arange(self.num_actions), action_size).tolist()]
+            if storage == 'sparse':
+                self.q_table = SparseQTable(self.num_states, self.num_actions, self.dtype)
+            else:
+                self.q_table = np.zeros((self.num_states, self.num_actions), dtype=self.dtype)
+        else:
+            # Initialize Q-table with zeros. The shape of the Q-table is state_size + action_size.
+            self.q_table = np.zeros(state_size + action_size, dtype=self.dtype)
+        self.start_episode()
 
     def _state_index(self, state):
         """
@@ -31,8 +86,10 @@ class QLearningAgent:
         - state: The current state of the environment (list of integers, including electricity and gas states).
 
         Returns:
-        - Tuple index corresponding to the given state for Q-table lookup.
+        - Tuple index corresponding to the given state for Q-table lookup, or the packed row index in compact mode.
         """
+        if self.compact:
+            return sum(w * int(s) for w, s in zip(self._state_weights, state))
         return tuple(state)
 
     def _action_index(self, action):
@@ -43,13 +100,24 @@ class QLearningAgent:
         - action: The action to be taken (list of integers, including actions for electricity and gas).
 
         Returns:
-        - Tuple index corresponding to the given action for Q-table lookup.
+        - Tuple index corresponding to the given action for Q-table lookup, or the packed column index in compact mode.
         """
+        if self.compact:
+            return sum(w * int(a) for w, a in zip(self._action_weights, action))
         return tuple(action)
 
+    def action_vector(self, action_index):
+        """
+        Convert a packed action index (compact mode) back to the list of appliance switches.
+        """
+        return list(self._action_vectors[action_index])
+
     def choose_action(self, state):
         state_index = self._state_index(state)
 
+        if self.compact:
+            return self.action_vector(self.choose_action_index(state_index))
+
         if np.random.rand() < self.epsilon:
             # Explore: random action for each appliance
             action = [np.random.randint(self.action_size[i]) for i in range(len(self.action_size))]
@@ -67,6 +135,52 @@ class QLearningAgent:
 
         return list(best_action)
 
+    def choose_action_index(self, state_index):
+        """
+        Epsilon-greedy action selection on packed indices (compact mode only).
+
+        Parameters:
+        - state_index: Packed state index (row of the compact Q-table).
+
+        Returns:
+        - Packed action index (column of the compact Q-table).
+        """
+        if np.random.rand() < self.epsilon:
+            return np.random.randint(self.num_actions)
+        return int(self.q_table[state_index].argmax())
+
+    def choose_actions(self, states, greedy=False):
+        """
+        Batched form of choose_action.
+
+        Parameters:
+        - states: (N, len(state_size)) array of states.
+        - greedy: If True, always take the best action instead of exploring with probability epsilon.
+
+        Returns:
+        - (N, len(action_size)) array of actions.
+        """
+        state_indices = encode(states, self.state_size)
+        return decode(self.choose_action_indices(state_indices, greedy=greedy), self.action_size)
+
+    def choose_action_indices(self, state_indices, greedy=False):
+        """
+        Batched form of choose_action_index, on packed indices (available in every mode).
+
+        Parameters:
+        - state_indices: (N,) array of packed state indices.
+        - greedy: If True, always take the best action instead of exploring with probability epsilon.
+
+        Returns:
+        - (N,) array of packed action indices.
+        """
+        state_indices = np.asarray(state_indices)
+        action_indices = self._q_rows(state_indices).argmax(axis=1)
+        if not greedy and self.epsilon > 0:
+            explore = np.random.rand(len(state_indices)) < self.epsilon
+            action_indices[explore] = np.random.randint(self.num_actions, size=int(explore.sum()))
+        return action_indices
+
     def learn(self, state, action, reward, next_state):
         """
         Update the Q-table using the Q-learning formula after taking an action.
@@ -77,17 +191,209 @@ class QLearningAgent:
         - reward: The reward received after taking the action.
         - next_state: The state of the environment after taking the action.
         """
+        if self.update_rule != 'q' and not self.compact:
+            self._learn_rule(int(encode(state, self.state_size)), int(encode(action, self.action_size)), reward,
+                             int(encode(next_state, self.state_size)))
+            return
+
         state_index = self._state_index(state)
         action_index = self._action_index(action)
         next_state_index = self._state_index(next_state)
 
+        if self.compact:
+            self.learn_index(state_index, action_index, reward, next_state_index)
+            return
+
         # Q-learning update rule: Q(s, a) = Q(s, a) + α * [r + γ * max_a' Q(s', a') − Q(s, a)]
         current_q = self.q_table[state_index][action_index]  # Current Q-value for the taken action
         next_max_q = np.max(self.q_table[next_state_index])  # Max Q-value for the next state
 
         # Update the Q-value for the action taken
-        self.q_table[state_index][action_index] = current_q + self.alpha * (
-                    reward + self.gamma * next_max_q - current_q)
+        td_error = reward + self.gamma * next_max_q - current_q
+        self.q_table[state_index][action_index] = current_q + self.alpha * td_error
+        if instrumentation.active is not None:
+            instrumentation.active.td_error(td_error)
+
+    def learn_index(self, state_index, action_index, reward, next_state_index):
+        """
+        Q-learning update on packed indices (compact mode only). Same rule as `learn`.
+        """
+        if self.update_rule != 'q':
+            self._learn_rule(state_index, action_index, reward, next_state_index)
+            return
+        q_values = self.q_table[state_index]
+        current_q = q_values[action_index]
+        next_max_q = self.q_table[next_state_index].max()
+        td_error = reward + self.gamma * next_max_q - current_q
+        q_values[action_index] = current_q + self.alpha * td_error
+        if instrumentation.active is not None:
+            instrumentation.active.td_error(td_error)
+
+    def start_episode(self):
+        """
+        Clear the eligibility traces or n-step buffer before an episode (nothing to do for one-step Q-learning).
+        """
+        if self.update_rule == 'q_lambda':
+            # Flat (state * num_actions + action) indices of the pairs with a trace, and their traces
+            self._trace_pairs = np.empty(0, dtype=np.int64)
+            self._trace_values = np.empty(0)
+        elif self.update_rule == 'n_step':
+            # Pairs and rewards of the last transitions whose n-step return is not complete yet, oldest first
+            self._pending_pairs = np.zeros(self.n_steps, dtype=np.int64)
+            self._pending_rewards = np.zeros(self.n_steps)
+            self._num_pending = 0
+            self._discounts = self.gamma ** np.arange(self.n_steps)
+            self._last_next_state = None
+
+    def end_episode(self):
+        """
+        Finish an episode: with the n-step rule, update the last pairs with the returns truncated at the end of
+        the episode (bootstrapped from its final state, as one-step Q-learning does).
+        """
+        if self.update_rule != 'n_step' or not self._num_pending:
+            return
+        q_flat = self._q_matrix().reshape(-1)
+        for i in range(self._num_pending):
+            rewards = self._pending_rewards[i:self._num_pending]
+            bootstrap = self.gamma ** len(rewards) * self._q_matrix()[self._last_next_state].max()
+            self._update_pair(q_flat, self._pending_pairs[i], self._discounts[:len(rewards)] @ rewards + bootstrap)
+        self._num_pending = 0
+
+    def _learn_rule(self, state_index, action_index, reward, next_state_index):
+        if self.update_rule == 'q_lambda':
+            self._learn_q_lambda(state_index, action_index, reward, next_state_index)
+        else:
+            self._learn_n_step(state_index, action_index, reward, next_state_index)
+
+    def _learn_q_lambda(self, state_index, action_index, reward, next_state_index):
+        q_matrix = self._q_matrix()
+        q_values = q_matrix[state_index]
+        current_q = q_values[action_index]
+        td_error = reward + self.gamma * q_matrix[next_state_index].max() - current_q
+        pair = state_index * self.num_actions + action_index
+
+        if current_q < q_values.max():
+            # Exploratory action: the earlier pairs no longer lead along the greedy path, cut their traces
+            pairs = np.array([pair], dtype=np.int64)
+            traces = np.ones(1)
+        else:
+            pairs, traces = self._trace_pairs, self._trace_values
+            visited = pairs == pair
+            if visited.any():
+                traces[visited] = 1.0  # Replacing traces
+            else:
+                pairs = np.append(pairs, pair)
+                traces = np.append(traces, 1.0)
+
+        # Every pair with a trace moves along with this TD error, then all traces decay at once
+        q_matrix.reshape(-1)[pairs] += self.alpha * td_error * traces
+        traces *= self.gamma * self.trace_decay
+        keep = traces >= TRACE_THRESHOLD
+        if not keep.all():
+            pairs, traces = pairs[keep], traces[keep]
+        self._trace_pairs, self._trace_values = pairs, traces
+        if instrumentation.active is not None:
+            instrumentation.active.td_error(td_error)
+
+    def _learn_n_step(self, state_index, action_index, reward, next_state_index):
+        self._pending_pairs[self._num_pending] = state_index * self.num_actions + action_index
+        self._pending_rewards[self._num_pending] = reward
+        self._num_pending += 1
+        self._last_next_state = next_state_index
+        if self._num_pending < self.n_steps:
+            return
+
+        # The return of the oldest pending pair is complete
+        n_step_return = (self._discounts @ self._pending_rewards +
+                         self.gamma ** self.n_steps * self._q_matrix()[next_state_index].max())
+        self._update_pair(self._q_matrix().reshape(-1), self._pending_pairs[0], n_step_return)
+        self._pending_pairs[:-1] = self._pending_pairs[1:]
+        self._pending_rewards[:-1] = self._pending_rewards[1:]
+        self._num_pending -= 1
+
+    def _update_pair(self, q_flat, pair, target):
+        td_error = target - q_flat[pair]
+        q_flat[pair] += self.alpha * td_error
+        if instrumentation.active is not None:
+            instrumentation.active.td_error(td_error)
+
+    def learn_batch(self, states, actions, rewards, next_states):
+        """
+        Batched form of learn, for many transitions at once (e.g. households stepping in parallel in a
+        BatchEnergyEnvironment, or a stored trajectory).
+
+        Parameters:
+        - states: (N, len(state_size)) array of states.
+        - actions: (N, len(action_size)) array of actions.
+        - rewards: (N,) array of rewards.
+        - next_states: (N, len(state_size)) array of next states.
+        """
+        self.learn_batch_index(encode(states, self.state_size), encode(actions, self.action_size), rewards,
+                               encode(next_states, self.state_size))
+
+    def learn_batch_index(self, state_indices, action_indices, rewards, next_state_indices, weights=None):
+        """
+        Batched Q-learning update on packed indices (available in every mode).
+
+        All TD errors r + gamma * max_a' Q(s', a') - Q(s, a) are computed from the table as it was before the
+        batch. The updates of a pair (s, a) that occurs n times are then applied as if in order, which gives
+        Q(s, a) += sum_k alpha * (1 - alpha)^(n - 1 - k) * td_error_k,
+        so duplicate pairs are all accounted for instead of the last write winning. A batch of one transition is
+        exactly `learn_index`. Optional per-transition weights (e.g. the importance-sampling weights of
+        prioritised replay) scale the TD errors.
+
+        Returns:
+        - The (N,) TD errors, before weighting.
+        """
+        state_indices = np.asarray(state_indices, dtype=np.int64)
+        action_indices = np.asarray(action_indices, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.float64)
+        next_state_indices = np.asarray(next_state_indices, dtype=np.int64)
+        if len(state_indices) == 0:
+            return np.empty(0)
+
+        current_q = self._q_rows(state_indices)[np.arange(len(state_indices)), action_indices]
+        td_errors = rewards + self.gamma * self._q_rows(next_state_indices).max(axis=1) - current_q
+        if instrumentation.active is not None:
+            instrumentation.active.td_errors(td_errors)
+
+        # Group the transitions by (s, a), keeping their order within each group
+        pairs = state_indices * self.num_actions + action_indices
+        order = np.argsort(pairs, kind='stable')
+        sorted_pairs = pairs[order]
+        new_group = np.r_[True, sorted_pairs[1:] != sorted_pairs[:-1]]
+        first = np.flatnonzero(new_group)
+        group = np.cumsum(new_group) - 1
+        counts = np.diff(np.r_[first, len(pairs)])
+        rank = np.arange(len(pairs)) - first[group]
+
+        step_sizes = self.alpha * (1 - self.alpha) ** (counts[group] - 1 - rank)
+        weighted_td_errors = td_errors if weights is None else td_errors * weights
+        increments = np.bincount(group, weights=step_sizes * weighted_td_errors[order], minlength=len(first))
+        updated_q = current_q[order[first]] + increments
+        unique_states, unique_actions = np.divmod(sorted_pairs[first], self.num_actions)
+
+        if self.storage == 'sparse':
+            for state_index, action_index, value in zip(unique_states.tolist(), unique_actions.tolist(),
+                                                        updated_q.tolist()):
+                self.q_table[state_index][action_index] = value
+        else:
+            self._q_matrix()[unique_states, unique_actions] = updated_q
+        return td_errors
+
+    def _q_matrix(self):
+        # (num_states, num_actions) view of a dense table, in either layout
+        return self.q_table.reshape(self.num_states, self.num_actions)
+
+    def _q_rows(self, state_indices):
+        # (N, num_actions) Q-values of the given packed states, without allocating sparse rows
+        if self.storage == 'sparse':
+            unique_states, inverse = np.unique(state_indices, return_inverse=True)
+            rows = np.zeros((len(unique_states), self.num_actions), dtype=self.dtype)
+            for i, state_index in enumerate(unique_states.tolist()):
+                rows[i] = self.q_table.get(state_index)
+            return rows[inverse]
+        return self._q_matrix()[state_indices]
 
     def update_epsilon(self, decay_rate):
         """
@@ -105,13 +411,50 @@ class QLearningAgent:
         Parameters:
         - filename: The path to the file where the Q-table will be saved.
         """
-        np.save(filename, self.q_table)
+        if self.storage == 'sparse':
+            # Only the visited rows are written, as an .npz archive under the given name
+            with open(filename, 'wb') as f:
+                self.q_table.save(f)
+            return
+
+        # Always saved in the multidimensional layout so files are interchangeable between modes
+        np.save(filename, self.q_table.reshape(self.state_size + self.action_size))
 
-    def load_q_table(self, filename):
+    def load_q_table(self, filename, mmap_mode=None):
         """
         Load the Q-table from a file.
 
         Parameters:
         - filename: The path to the file where the Q-table is saved.
+        - mmap_mode: Passed to np.load to memory-map the table instead of reading it ('r', 'c', ...).
+        """
+        q_table = np.load(filename, mmap_mode=mmap_mode)
+        if isinstance(q_table, np.lib.npyio.NpzFile):
+            # Sparse table archive
+            with q_table:
+                sparse_table = SparseQTable.load(q_table, self.dtype)
+            if self.storage == 'sparse' and sparse_table.shape == (self.num_states, self.num_actions):
+                self.q_table = sparse_table
+                return
+            q_table = np.asarray(sparse_table)
+
+        if self.compact:
+            if q_table.size != self.num_states * self.num_actions:
+                raise ValueError(f"Q-table in {filename} has shape {q_table.shape}, expected "
+                                 f"{tuple(self.state_size + self.action_size)}")
+        self.set_q_table(q_table)
+
+    def set_q_table(self, q_values):
+        """
+        Replace the Q-table with the given dense Q-values, in either the multidimensional or the
+        (num_states, num_actions) layout, converting them to the agent's layout, storage and dtype.
         """
-        self.q_table = np.load(filename)
+        q_values = q_values.astype(self.dtype, copy=False)
+        if self.storage == 'sparse':
+            self.q_table = SparseQTable.from_dense(q_values.reshape(self.num_states, self.num_actions))
+        elif self.compact:
+            self.q_table = q_values.reshape(self.num_states, self.num_actions)
+        elif q_values.size == self.num_states * self.num_actions:
+            self.q_table = q_values.reshape(self.state_size + self.action_size)
+        else:
+            self.q_table = q_values
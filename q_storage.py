@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class SparseQTable:
+    def __init__(self, num_states, num_actions, dtype=np.float64):
+        """
+        Dict-backed Q-table that only allocates a row for states the agent has visited.
+
+        It behaves like the 2-D (num_states, num_actions) table of a compact QLearningAgent for the operations
+        the agent uses: `table[state_index]` returns the writable row of Q-values of that state, allocating a row
+        of zeros on first access. `np.asarray(table)` gives the equivalent dense table.
+
+        Parameters:
+        - num_states: Number of (packed) states.
+        - num_actions: Number of (packed) actions.
+        - dtype: dtype of the Q-values.
+        """
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.dtype = np.dtype(dtype)
+        self.shape = (num_states, num_actions)
+        self.rows = {}
+
+    def __getitem__(self, state_index):
+        row = self.rows.get(state_index)
+        if row is None:
+            row = self.rows[state_index] = np.zeros(self.num_actions, dtype=self.dtype)
+        return row
+
+    def get(self, state_index):
+        """
+        Return the row of state_index without allocating it (a read-only row of zeros if it was never visited).
+        """
+        row = self.rows.get(state_index)
+        if row is None:
+            row = np.zeros(self.num_actions, dtype=self.dtype)
+            row.setflags(write=False)
+        return row
+
+    def __len__(self):
+        return self.num_states
+
+    def __array__(self, dtype=None):
+        dense = np.zeros(self.shape, dtype=dtype or self.dtype)
+        for state_index, row in self.rows.items():
+            dense[state_index] = row
+        return dense
+
+    @property
+    def nbytes(self):
+        return sum(row.nbytes for row in self.rows.values())
+
+    def any(self):
+        return any(row.any() for row in self.rows.values())
+
+    def reshape(self, *shape):
+        return np.asarray(self).reshape(*shape)
+
+    @classmethod
+    def from_dense(cls, q_values, dtype=None):
+        """
+        Build a sparse table from a dense (num_states, num_actions) array, keeping only rows with a non-zero value.
+        """
+        q_values = np.asarray(q_values)
+        table = cls(q_values.shape[0], q_values.shape[1], dtype or q_values.dtype)
+        for state_index in np.flatnonzero(q_values.any(axis=1)).tolist():
+            table.rows[state_index] = q_values[state_index].astype(table.dtype)
+        return table
+
+    def save(self, file):
+        """
+        Save the allocated rows to an .npz archive (file name or open file).
+        """
+        states = np.array(sorted(self.rows), dtype=np.int64)
+        values = (np.stack([self.rows[state_index] for state_index in states.tolist()]) if len(states)
+                  else np.zeros((0, self.num_actions), dtype=self.dtype))
+        np.savez(file, states=states, values=values, shape=np.array(self.shape))
+
+    @classmethod
+    def load(cls, archive, dtype=None):
+        """
+        Load a table saved with `save` from an opened np.load archive.
+        """
+        num_states, num_actions = archive['shape'].tolist()
+        values = archive['values']
+        table = cls(num_states, num_actions, dtype or values.dtype)
+        for state_index, row in zip(archive['states'].tolist(), values):
+            table.rows[state_index] = row.astype(table.dtype)
+        return table
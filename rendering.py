@@ -0,0 +1,325 @@
+import hashlib
+import json
+import math
+import os
+import re
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Bump when a template's drawing changes, so figures rendered by the old version are not skipped
+TEMPLATE_VERSION = 1
+
+MANIFEST_NAME = '.render_manifest.json'
+
+
+class FigureTemplate(ABC):
+    """
+    A figure and its axes, built once on the object-oriented Agg API and updated with new data for every
+    scenario, instead of creating a pyplot figure per plot.
+
+    The layout is fixed when the template is built (subplot margins instead of tight_layout on every figure),
+    so rendering a figure is one draw.
+    """
+    figsize = (10, 6)
+    margins = {'left': 0.1, 'right': 0.9, 'bottom': 0.1, 'top': 0.9}
+
+    def __init__(self):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=self.figsize)
+        FigureCanvasAgg(self.figure)
+        self.build()
+        self.figure.subplots_adjust(**self.margins)
+
+    @abstractmethod
+    def build(self):
+        """
+        Create the axes and artists of the figure, once per template.
+        """
+
+    @abstractmethod
+    def update(self, data):
+        """
+        Set the artists' data, limits and titles from a scenario's data.
+        """
+
+    def render(self, data, path):
+        self.update(data)
+        self.figure.savefig(path)
+
+
+def _limits(values, margin=0.1):
+    return min(values) * (1 - margin), max(values) * (1 + margin)
+
+
+class ComparisonTemplate(FigureTemplate):
+    # Trained agent vs random policy: electricity, gas and cost on three y-axes (as generate_comparison_graphs)
+    margins = {'left': 0.09, 'right': 0.8, 'bottom': 0.1, 'top': 0.93}
+
+    def build(self):
+        x = range(2)
+        self.ax1 = self.figure.add_subplot()
+        self.electricity, = self.ax1.plot(x, [0, 0], marker='o', color='blue', label='Electricity Usage (kWh)',
+                                          linewidth=2)
+        self.ax1.set_xlabel('Policy')
+        self.ax1.set_ylabel('Electricity Usage (kWh)', color='blue')
+        self.ax1.set_xticks(x)
+        self.ax1.set_xticklabels(['Trained Agent', 'Random Policy'])
+        self.ax1.tick_params(axis='y', labelcolor='blue')
+
+        self.ax2 = self.ax1.twinx()
+        self.gas, = self.ax2.plot(x, [0, 0], marker='s', color='red', label='Gas Usage (kWh)', linewidth=2)
+        self.ax2.set_ylabel('Gas Usage (kWh)', color='red')
+        self.ax2.tick_params(axis='y', labelcolor='red')
+
+        self.ax3 = self.ax1.twinx()
+        self.ax3.spines['right'].set_position(('outward', 60))
+        self.cost, = self.ax3.plot(x, [0, 0], marker='^', color='green', label='Total Cost (£)', linewidth=2)
+        self.ax3.set_ylabel('Total Cost (£)', color='green')
+        self.ax3.tick_params(axis='y', labelcolor='green')
+
+        self.ax1.legend(loc='upper left')
+        self.ax2.legend(loc='upper right')
+        self.ax3.legend(loc='center right')
+
+    def update(self, data):
+        for line, axis, name in ((self.electricity, self.ax1, 'electricity'), (self.gas, self.ax2, 'gas'),
+                                 (self.cost, self.ax3, 'cost')):
+            values = [data[f'{name}_trained'], data[f'{name}_random']]
+            line.set_ydata(values)
+            axis.set_ylim(*_limits(values))
+        self.ax3.set_title(f"{data['title']} - Electricity, Gas, and Cost Comparison")
+
+
+class EnergyUsageTemplate(FigureTemplate):
+    # ABM vs trained agent vs random policy bars of electricity and gas usage
+    figsize = (6.4, 4.8)
+    margins = {'left': 0.13, 'right': 0.97, 'bottom': 0.11, 'top': 0.92}
+    width = 0.35
+
+    def build(self):
+        policies = ['ABM', 'Trained Agent', 'Random Policy']
+        x = np.arange(len(policies))
+        self.ax = self.figure.add_subplot()
+        self.electricity = self.ax.bar(x - self.width / 2, np.zeros(len(x)), self.width, label='Electricity Usage')
+        self.gas = self.ax.bar(x + self.width / 2, np.zeros(len(x)), self.width, label='Gas Usage')
+        self.ax.set_xlabel('Policy')
+        self.ax.set_ylabel('Energy Usage (kWh)')
+        self.ax.set_xticks(x)
+        self.ax.set_xticklabels(policies)
+        self.ax.legend()
+
+    def update(self, data):
+        heights = []
+        for bars, name in ((self.electricity, 'electricity'), (self.gas, 'gas')):
+            values = [data.get(f'{name}_abm', 0), data[f'{name}_trained'], data[f'{name}_random']]
+            for bar, value in zip(bars, values):
+                bar.set_height(value)
+            heights.extend(values)
+        self.ax.set_ylim(0, max(heights) * 1.05 or 1)
+        self.ax.set_title(f"Energy Usage Comparison during {data['title']}")
+
+
+class SeasonCostTemplate(FigureTemplate):
+    # Cost of the trained agent and the random policy, one panel per season (as generate_season_comparison_graphs)
+    figsize = (14, 6)
+    margins = {'left': 0.06, 'right': 0.98, 'bottom': 0.07, 'top': 0.88, 'wspace': 0.2}
+
+    def build(self):
+        policies = ['Trained Agent', 'Random Policy']
+        self.axes = self.figure.subplots(1, 2)
+        self.bars = []
+        for ax, season in zip(self.axes, ['Winter', 'Summer']):
+            self.bars.append(ax.bar(policies, [0, 0], color=['blue', 'orange']))
+            ax.set_title(f'Energy Cost during {season}')
+            ax.set_ylabel('£')
+        self.figure.suptitle('Comparison of Energy Costs')
+
+    def update(self, data):
+        for ax, bars, season in zip(self.axes, self.bars, ['winter', 'summer']):
+            values = [data[f'{season}_cost_trained'], data[f'{season}_cost_random']]
+            for bar, value in zip(bars, values):
+                bar.set_height(value)
+            ax.set_ylim(0, max(values) * 1.05 or 1)
+
+
+class HouseholdUsageTemplate(FigureTemplate):
+    # House size vs electricity and gas usage of the ABM households, one panel per season
+    figsize = (10, 7)
+    margins = {'left': 0.09, 'right': 0.98, 'bottom': 0.08, 'top': 0.95, 'wspace': 0.25}
+
+    def build(self):
+        self.axes = self.figure.subplots(1, 2)
+        self.points = []
+        for ax, season in zip(self.axes, ['winter', 'summer']):
+            electricity = ax.scatter([], [], c='blue', label='Electricity Usage (kWh)', marker='o')
+            gas = ax.scatter([], [], c='red', label='Gas Usage (kWh)', marker='x')
+            self.points.append((electricity, gas))
+            ax.set_xlabel('House Size (Number of People)')
+            ax.set_ylabel('Usage (kWh)')
+            ax.set_title(f'{season.capitalize()} - House Size vs Usage')
+            ax.legend()
+
+    def update(self, data):
+        for ax, (electricity, gas), season in zip(self.axes, self.points, ['winter', 'summer']):
+            people = np.asarray(data[f'{season}_num_people'], dtype=float)
+            electricity_usage = np.asarray(data[f'{season}_electricity'], dtype=float)
+            gas_usage = np.asarray(data[f'{season}_gas'], dtype=float)
+            electricity.set_offsets(np.column_stack([people, electricity_usage]))
+            gas.set_offsets(np.column_stack([people, gas_usage]))
+            if len(people):
+                ax.set_xlim(people.min() - 0.5, people.max() + 0.5)
+                ax.set_ylim(0, max(electricity_usage.max(), gas_usage.max()) * 1.05 or 1)
+
+
+TEMPLATES = {
+    'comparison': ComparisonTemplate,
+    'energy_usage': EnergyUsageTemplate,
+    'season_costs': SeasonCostTemplate,
+    'household_usage': HouseholdUsageTemplate,
+}
+
+# Templates built in this process, reused for every figure of the same kind
+_templates = {}
+
+
+def _template(kind):
+    template = _templates.get(kind)
+    if template is None:
+        template = _templates[kind] = TEMPLATES[kind]()
+    return template
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot hash {type(value).__name__}")
+
+
+def data_hash(kind, data):
+    """
+    Hash the input of a figure: its kind, the template version and the data.
+    """
+    canonical = json.dumps([kind, TEMPLATE_VERSION, data], sort_keys=True, default=_json_default)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def scenario_filename(kind, key):
+    """
+    Return the file name of a figure: the kind and the scenario key, made safe for file systems.
+    """
+    return f"{kind}_{re.sub(r'[^A-Za-z0-9._-]+', '_', str(key))}.png"
+
+
+def _render_chunk(jobs):
+    # Runs in a worker process: render a list of (kind, path, data) with the process's templates
+    for kind, path, data in jobs:
+        _template(kind).render(data, path)
+    return len(jobs)
+
+
+def render_figures(figures, output_dir, workers=None, force=False):
+    """
+    Render figures into output_dir, skipping those whose input data is unchanged since the last render.
+
+    Parameters:
+    - figures: List of (kind, filename, data) with kind a key of TEMPLATES and data the dict its template needs.
+    - output_dir: Directory of the figures and of the manifest of their data hashes.
+    - workers: Number of worker processes; 1 renders in this process. Defaults to the number of CPUs.
+    - force: Render every figure even if its data is unchanged.
+
+    Returns:
+    - Dict with the number of 'rendered' and 'skipped' figures.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    pending = []
+    hashes = {}
+    for kind, filename, data in figures:
+        digest = data_hash(kind, data)
+        path = os.path.join(output_dir, filename)
+        if not force and manifest.get(filename) == digest and os.path.exists(path):
+            continue
+        hashes[filename] = digest
+        pending.append((kind, path, data))
+
+    # Figures of the same kind go to the same chunk, so each worker reuses its templates
+    pending.sort(key=lambda job: job[0])
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(pending) <= 1:
+        _render_chunk(pending)
+    else:
+        chunk_size = max(1, math.ceil(len(pending) / (workers * 4)))
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_render_chunk, chunks))
+
+    manifest.update(hashes)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return {'rendered': len(pending), 'skipped': len(figures) - len(pending)}
+
+
+def scenario_figures(scenarios, kinds=('comparison', 'energy_usage'), key='job_id'):
+    """
+    Build the figures of a table of scenario results, e.g. the results of sweep.py.
+
+    Parameters:
+    - scenarios: DataFrame or list of dicts with a key column, 'season' and the electricity/gas/cost of the
+      trained and random policy (electricity_trained, ..., cost_random). Optional electricity_abm and gas_abm
+      are shown in the energy usage figure.
+    - kinds: Figures to render per scenario.
+    - key: Column identifying a scenario, used in the file names.
+
+    Returns:
+    - List of (kind, filename, data) for render_figures.
+    """
+    if hasattr(scenarios, 'to_dict'):
+        scenarios = scenarios.to_dict('records')
+    fields = [f'{name}_{policy}' for name in ('electricity', 'gas', 'cost') for policy in ('trained', 'random')]
+    figures = []
+    for scenario in scenarios:
+        data = {field: float(scenario[field]) for field in fields}
+        for field in ('electricity_abm', 'gas_abm'):
+            if field in scenario:
+                data[field] = float(scenario[field])
+        data['title'] = str(scenario.get('season', scenario[key])).capitalize()
+        for kind in kinds:
+            figures.append((kind, scenario_filename(kind, scenario[key]), data))
+    return figures
+
+
+def household_usage_figure(household_data, filename='household_size_vs_usage.png'):
+    """
+    Build the house size vs usage figure from the household data of each season.
+
+    Parameters:
+    - household_data: Dict of season ('winter', 'summer') -> DataFrame with the household data columns.
+    """
+    data = {}
+    for season in ('winter', 'summer'):
+        df = household_data[season]
+        data[f'{season}_num_people'] = df["Num People"].to_numpy()
+        data[f'{season}_electricity'] = df["Electricity Usage"].to_numpy()
+        data[f'{season}_gas'] = df["Gas Usage"].to_numpy()
+    return 'household_usage', filename, data
+
+
+def season_costs_figure(data, filename='energy_cost_comparison.png'):
+    """
+    Build the season cost figure from the same list as generate_season_comparison_graphs (winter trained,
+    winter random, summer trained, summer random, each a dict with a 'cost').
+    """
+    names = ['winter_cost_trained', 'winter_cost_random', 'summer_cost_trained', 'summer_cost_random']
+    return 'season_costs', filename, {name: float(entry['cost']) for name, entry in zip(names, data)}
+
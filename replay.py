@@ -0,0 +1,201 @@
+import json
+
+import numpy as np
+
+
+class ReplayBuffer:
+    def __init__(self, capacity, num_states, num_actions, batch_size=64, interval=24, prioritized=False,
+                 priority_exponent=0.6, importance_exponent=0.4, seed=None):
+        """
+        Fixed-capacity experience replay of packed transitions, held in preallocated ring-buffer arrays.
+
+        States and actions are stored as packed codes (see encoding.py) in the smallest unsigned integer dtype that
+        holds them (uint8 for the 32 states and actions of EnergyEnvironment) and rewards as float32, so a
+        transition takes a few bytes (bytes_per_transition) instead of several Python objects. Once the buffer is
+        full, new transitions overwrite the oldest.
+
+        During training (see `step`), every `interval` transitions a minibatch of `batch_size` stored
+        transitions is replayed through QLearningAgent.learn_batch_index. Minibatches are drawn uniformly or, with
+        `prioritized`, with probability proportional to |TD error| ** priority_exponent of the transition's last
+        replay (new transitions get the highest priority so far), and weighted by the importance-sampling
+        weights (size * P) ** -importance_exponent, normalised to a maximum of 1.
+
+        Parameters:
+        - capacity: Maximum number of transitions.
+        - num_states, num_actions: Number of packed states and actions.
+        - batch_size: Transitions per replayed minibatch.
+        - interval: Replay a minibatch after every this many new transitions.
+        - prioritized: Use prioritised instead of uniform sampling.
+        - priority_exponent, importance_exponent: Exponents of the prioritised sampling.
+        - seed: Seed of the buffer's own numpy.random.Generator; sampling never draws from np.random.
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.batch_size = batch_size
+        self.interval = interval
+        self.prioritized = prioritized
+        self.priority_exponent = priority_exponent
+        self.importance_exponent = importance_exponent
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        state_dtype = np.min_scalar_type(num_states - 1)
+        action_dtype = np.min_scalar_type(num_actions - 1)
+        self.states = np.zeros(capacity, dtype=state_dtype)
+        self.actions = np.zeros(capacity, dtype=action_dtype)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros(capacity, dtype=state_dtype)
+        self.priorities = np.zeros(capacity, dtype=np.float32) if prioritized else None
+        self.max_priority = 1.0
+        self.position = 0  # Slot of the next transition
+        self.size = 0
+        self.added = 0  # Transitions ever added; restored by load, so the replay schedule survives a save/load
+
+    def __len__(self):
+        return self.size
+
+    def _arrays(self):
+        arrays = [self.states, self.actions, self.rewards, self.next_states]
+        return arrays if self.priorities is None else arrays + [self.priorities]
+
+    @property
+    def bytes_per_transition(self):
+        return sum(array.itemsize for array in self._arrays())
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays())
+
+    def settings(self):
+        return {
+            'capacity': self.capacity,
+            'num_states': self.num_states,
+            'num_actions': self.num_actions,
+            'batch_size': self.batch_size,
+            'interval': self.interval,
+            'prioritized': self.prioritized,
+            'priority_exponent': self.priority_exponent,
+            'importance_exponent': self.importance_exponent,
+            'seed': self.seed,
+        }
+
+    def add(self, state_index, action_index, reward, next_state_index):
+        """
+        Store one transition, overwriting the oldest once the buffer is full.
+        """
+        position = self.position
+        self.states[position] = state_index
+        self.actions[position] = action_index
+        self.rewards[position] = reward
+        self.next_states[position] = next_state_index
+        if self.priorities is not None:
+            self.priorities[position] = self.max_priority
+        self.position = (position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.added += 1
+
+    def add_batch(self, state_indices, action_indices, rewards, next_state_indices):
+        """
+        Store many transitions at once, in order. Only the last `capacity` are kept if more are given.
+        """
+        count = len(state_indices)
+        keep = min(count, self.capacity)
+        slots = (self.position + np.arange(count - keep, count)) % self.capacity
+        self.states[slots] = np.asarray(state_indices)[count - keep:]
+        self.actions[slots] = np.asarray(action_indices)[count - keep:]
+        self.rewards[slots] = np.asarray(rewards)[count - keep:]
+        self.next_states[slots] = np.asarray(next_state_indices)[count - keep:]
+        if self.priorities is not None:
+            self.priorities[slots] = self.max_priority
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        self.added += count
+
+    def sample(self, batch_size=None):
+        """
+        Draw a minibatch of stored transitions (with replacement).
+
+        Returns:
+        - (slots, states, actions, rewards, next_states, weights): the buffer slots of the transitions (for
+          update_priorities), their packed codes and rewards, and their importance-sampling weights (None for
+          uniform sampling).
+        """
+        batch_size = batch_size or self.batch_size
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty replay buffer")
+        if self.priorities is None:
+            slots = self.rng.integers(0, self.size, batch_size)
+            weights = None
+        else:
+            scaled = self.priorities[:self.size].astype(np.float64) ** self.priority_exponent
+            cumulative = np.cumsum(scaled)
+            slots = np.searchsorted(cumulative, self.rng.random(batch_size) * cumulative[-1], side='right')
+            slots = np.minimum(slots, self.size - 1)
+            probabilities = scaled[slots] / cumulative[-1]
+            weights = (self.size * probabilities) ** -self.importance_exponent
+            weights /= weights.max()
+        return (slots, self.states[slots], self.actions[slots], self.rewards[slots], self.next_states[slots],
+                weights)
+
+    def update_priorities(self, slots, td_errors):
+        priorities = np.abs(td_errors) + 1e-6
+        self.priorities[slots] = priorities
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def replay(self, agent, batch_size=None):
+        """
+        Apply one sampled minibatch to the agent with its vectorised update (QLearningAgent.learn_batch_index).
+        """
+        slots, states, actions, rewards, next_states, weights = self.sample(batch_size)
+        td_errors = agent.learn_batch_index(states, actions, rewards, next_states, weights)
+        if self.priorities is not None:
+            self.update_priorities(slots, td_errors)
+        return td_errors
+
+    def step(self, agent, state_index, action_index, reward, next_state_index):
+        """
+        Store a transition of the training loop and replay a minibatch every `interval` transitions.
+        """
+        self.add(state_index, action_index, reward, next_state_index)
+        if self.added % self.interval == 0 and self.size >= self.batch_size:
+            self.replay(agent)
+
+    def save(self, file):
+        """
+        Save the buffer (settings, transitions and priorities) to an .npz archive (file name or open file).
+        """
+        arrays = {'states': self.states, 'actions': self.actions, 'rewards': self.rewards,
+                  'next_states': self.next_states}
+        if self.priorities is not None:
+            arrays['priorities'] = self.priorities
+        state = {'position': self.position, 'size': self.size, 'added': self.added,
+                 'max_priority': self.max_priority}
+        np.savez(file, settings=json.dumps(self.settings()), state=json.dumps(state), **arrays)
+
+    @classmethod
+    def load(cls, file, **overrides):
+        """
+        Load a buffer saved with `save`. Keyword arguments override its settings, e.g. a different batch_size
+        or a larger capacity (the stored transitions are kept, oldest first).
+        """
+        with np.load(file) as archive:
+            settings = json.loads(str(archive['settings']))
+            state = json.loads(str(archive['state']))
+            arrays = {name: archive[name] for name in ('states', 'actions', 'rewards', 'next_states', 'priorities')
+                      if name in archive}
+        buffer = cls(**{**settings, **overrides})
+
+        # Stored transitions in chronological order
+        size = state['size']
+        order = (state['position'] - size + np.arange(size)) % len(arrays['states'])
+        buffer.add_batch(arrays['states'][order], arrays['actions'][order], arrays['rewards'][order],
+                         arrays['next_states'][order])
+        if buffer.priorities is not None and 'priorities' in arrays:
+            keep = min(size, buffer.capacity)
+            buffer.priorities[np.arange(size - keep, size) % buffer.capacity] = arrays['priorities'][order[size - keep:]]
+            buffer.max_priority = state['max_priority']
+        buffer.added = state['added']
+        return buffer
@@ -0,0 +1,140 @@
+import argparse
+import itertools
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+
+def build_jobs(seasons, num_rooms, alphas, gammas, epsilons, seeds, episodes, root_seed=0):
+    """
+    Build the list of sweep jobs, one per combination of the given values.
+
+    Each job gets its own SeedSequence derived from the root seed and the job's parameters, so a job always
+    trains with the same random numbers, whatever the pool size, the order jobs finish in or the other values
+    in the grid.
+
+    Returns:
+    - List of job dicts.
+    """
+    jobs = []
+    grid = itertools.product(seasons, num_rooms, alphas, gammas, epsilons, seeds)
+    for season, rooms, alpha, gamma, epsilon, seed in grid:
+        job_id = f"{season}-r{rooms}-a{alpha}-g{gamma}-e{epsilon}-s{seed}-n{episodes}-root{root_seed}"
+        jobs.append({
+            'job_id': job_id,
+            'season': season,
+            'num_rooms': rooms,
+            'alpha': alpha,
+            'gamma': gamma,
+            'epsilon': epsilon,
+            'seed': seed,
+            'episodes': episodes,
+            'seed_sequence': np.random.SeedSequence([root_seed, zlib.crc32(job_id.encode())]),
+        })
+    return jobs
+
+
+def run_job(job):
+    """
+    Train and evaluate one EnergyModel. Runs in a worker process.
+
+    Returns:
+    - Dict with the job parameters and the trained/random electricity, gas and cost.
+    """
+    from main import EnergyModel
+
+    # The training and evaluation code draws from the global legacy generator
+    np.random.seed(job['seed_sequence'].generate_state(4))
+
+    model = EnergyModel(0, job['num_rooms'], job['season'], compact=True,
+                        agent_params={'alpha': job['alpha'], 'gamma': job['gamma'], 'epsilon': job['epsilon']})
+    start = time.perf_counter()
+    model.train_agent(episodes=job['episodes'])
+    train_seconds = time.perf_counter() - start
+
+    electricity_trained, gas_trained, cost_trained = model.test_agent_exploitation()
+    electricity_random, gas_random, cost_random = model.test_random_policy()
+
+    result = {key: value for key, value in job.items() if key != 'seed_sequence'}
+    result.update({
+        'train_seconds': train_seconds,
+        'electricity_trained': electricity_trained,
+        'gas_trained': gas_trained,
+        'cost_trained': cost_trained,
+        'electricity_random': electricity_random,
+        'gas_random': gas_random,
+        'cost_random': cost_random,
+    })
+    return result
+
+
+def load_finished(results_path):
+    """
+    Read the results of finished jobs from a JSONL results file, keyed by job_id.
+    """
+    finished = {}
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    result = json.loads(line)
+                    finished[result['job_id']] = result
+    return finished
+
+
+def run_sweep(jobs, results_path, workers=None):
+    """
+    Run the jobs on a process pool and return all results as a DataFrame.
+
+    Every finished job is appended to results_path straight away, and jobs already in that file are skipped,
+    so an interrupted sweep resumes where it stopped.
+    """
+    import pandas as pd
+
+    finished = load_finished(results_path)
+    pending = [job for job in jobs if job['job_id'] not in finished]
+    print(f"{len(finished)} jobs already finished, running {len(pending)} jobs")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(results_path, 'a') as f:
+            futures = [pool.submit(run_job, job) for job in pending]
+            for future in as_completed(futures):
+                result = future.result()
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+                finished[result['job_id']] = result
+                print(f"Finished {result['job_id']} (cost trained £{result['cost_trained']:.2f})")
+
+    job_ids = [job['job_id'] for job in jobs]
+    return pd.DataFrame([finished[job_id] for job_id in job_ids])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep seasons, room counts and Q-learning hyperparameters")
+    parser.add_argument('--seasons', nargs='+', default=['winter', 'summer'])
+    parser.add_argument('--rooms', nargs='+', type=int, default=[3])
+    parser.add_argument('--alphas', nargs='+', type=float, default=[0.1])
+    parser.add_argument('--gammas', nargs='+', type=float, default=[0.95])
+    parser.add_argument('--epsilons', nargs='+', type=float, default=[0.05])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--episodes', type=int, default=2000)
+    parser.add_argument('--root-seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--results', default='data/sweep_results.jsonl')
+    parser.add_argument('--output', default='data/sweep_results.csv')
+    args = parser.parse_args()
+
+    jobs = build_jobs(args.seasons, args.rooms, args.alphas, args.gammas, args.epsilons, args.seeds,
+                      args.episodes, root_seed=args.root_seed)
+    results = run_sweep(jobs, args.results, workers=args.workers)
+    results.to_csv(args.output, index=False)
+    print(f"Saved {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Hourly mean temperature (°C) below which an hour counts as cold
+COLD_TEMPERATURE = 8.0
+
+# Slots read from the files at a time when scanning a whole series
+CHUNK_HOURS = 24 * 365
+
+
+class EnergyTimeSeries:
+    def __init__(self, electricity_price, temperature=None, steps_per_hour=1, cold_temperature=COLD_TEMPERATURE):
+        """
+        Electricity tariff and outdoor temperature series that drive EnergyEnvironment instead of the fixed
+        peak/off-peak prices, 90-day horizon and cold-hour heuristic.
+
+        The series are kept as given (typically np.memmap arrays from `load`) and only the slots of the hours
+        asked for are read, so multi-year half-hourly series for many regions never have to fit in memory.
+        The first slot is midnight of the first day, and the environment steps hourly: the price and
+        temperature of an hour are the means of its slots.
+
+        Parameters:
+        - electricity_price: 1-D array of electricity prices (pence per kWh), one per slot.
+        - temperature: Optional 1-D array of outdoor temperatures (°C), one per slot.
+        - steps_per_hour: Number of slots per hour, e.g. 2 for half-hourly data.
+        - cold_temperature: Hours with a mean temperature below this are cold hours.
+        """
+        if temperature is not None and len(temperature) != len(electricity_price):
+            raise ValueError("electricity_price and temperature must have the same length")
+        self.electricity_price = electricity_price
+        self.temperature = temperature
+        self.steps_per_hour = steps_per_hour
+        self.cold_temperature = cold_temperature
+
+        # The horizon is the number of whole hours in the series
+        self.num_hours = len(electricity_price) // steps_per_hour
+        self.num_days = -(-self.num_hours // 24)
+        if self.num_hours == 0:
+            raise ValueError("The series must cover at least one hour")
+
+    @classmethod
+    def load(cls, directory, region=None, mmap_mode='r', **kwargs):
+        """
+        Memory-map the series saved in a directory.
+
+        The directory holds electricity_price.npy and optionally temperature.npy, or the same names with a
+        .bin extension for raw binary files, plus an optional metadata.json with 'steps_per_hour' and, for
+        .bin files, 'dtype' (default float32) and 'regions'. 2-D series have one column per region.
+
+        Parameters:
+        - directory: Directory of the series.
+        - region: Column to use for series with several regions.
+        - mmap_mode: Passed to np.load / np.memmap.
+        - kwargs: Passed to EnergyTimeSeries, overriding the metadata.
+        """
+        metadata_path = os.path.join(directory, 'metadata.json')
+        metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+
+        def read(name):
+            path = os.path.join(directory, f"{name}.npy")
+            if os.path.exists(path):
+                values = np.load(path, mmap_mode=mmap_mode)
+            elif os.path.exists(os.path.join(directory, f"{name}.bin")):
+                values = np.memmap(os.path.join(directory, f"{name}.bin"), mode=mmap_mode,
+                                   dtype=metadata.get('dtype', 'float32'))
+                if metadata.get('regions'):
+                    values = values.reshape(-1, metadata['regions'])
+            else:
+                return None
+            if values.ndim == 2:
+                if region is None:
+                    raise ValueError(f"{name} has {values.shape[1]} regions, pass region=")
+                values = values[:, region]  # A strided view, still memory-mapped
+            return values
+
+        electricity_price = read('electricity_price')
+        if electricity_price is None:
+            raise FileNotFoundError(f"No electricity_price.npy or electricity_price.bin in {directory}")
+        kwargs.setdefault('steps_per_hour', metadata.get('steps_per_hour', 1))
+        return cls(electricity_price, read('temperature'), **kwargs)
+
+    @staticmethod
+    def save(directory, electricity_price, temperature=None, steps_per_hour=1):
+        """
+        Write series in the .npy layout read by `load`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'electricity_price.npy'), electricity_price)
+        if temperature is not None:
+            np.save(os.path.join(directory, 'temperature.npy'), temperature)
+        with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+            json.dump({'steps_per_hour': steps_per_hour}, f)
+
+    def _hourly(self, values, start, stop):
+        # Hourly means of the slots of hours [start, stop), reading only those slots
+        k = self.steps_per_hour
+        slots = np.asarray(values[start * k:stop * k], dtype=np.float64)
+        if k == 1:
+            return slots
+        return slots.reshape(-1, k).mean(axis=1)
+
+    def price(self, hour):
+        """
+        Return the electricity price (pence per kWh) of one hour since the start of the series.
+        """
+        if self.steps_per_hour == 1:
+            return float(self.electricity_price[hour])
+        return float(self._hourly(self.electricity_price, hour, hour + 1)[0])
+
+    def hourly_prices(self, start=0, stop=None):
+        """
+        Return the (stop - start,) electricity prices (pence per kWh) of hours [start, stop).
+        """
+        return self._hourly(self.electricity_price, start, self.num_hours if stop is None else stop)
+
+    def hourly_temperatures(self, start=0, stop=None):
+        """
+        Return the (stop - start,) temperatures of hours [start, stop), or None without a temperature series.
+        """
+        if self.temperature is None:
+            return None
+        return self._hourly(self.temperature, start, self.num_hours if stop is None else stop)
+
+    def cold_hours(self, start=0, stop=None):
+        """
+        Return a boolean array marking the cold hours in [start, stop), or None without a temperature series.
+        """
+        temperatures = self.hourly_temperatures(start, stop)
+        if temperatures is None:
+            return None
+        return temperatures < self.cold_temperature
+
+    def daily_price_profile(self):
+        """
+        Return the (24,) mean price of each hour of day over the whole series, read in chunks.
+        """
+        totals = np.zeros(24)
+        counts = np.zeros(24)
+        for start in range(0, self.num_hours, CHUNK_HOURS):
+            prices = self.hourly_prices(start, min(start + CHUNK_HOURS, self.num_hours))
+            hours = (start + np.arange(len(prices))) % 24
+            totals += np.bincount(hours, weights=prices, minlength=24)
+            counts += np.bincount(hours, minlength=24)
+        return totals / np.maximum(counts, 1)
+
+    def fingerprint(self):
+        """
+        Return a hash of the series contents and settings, read in chunks (used in training cache keys).
+        """
+        digest = hashlib.sha1()
+        digest.update(repr((self.steps_per_hour, self.cold_temperature, self.num_hours)).encode())
+        for values in (self.electricity_price, self.temperature):
+            if values is None:
+                continue
+            slots = CHUNK_HOURS * self.steps_per_hour
+            for start in range(0, len(values), slots):
+                digest.update(np.ascontiguousarray(values[start:start + slots], dtype=np.float64).tobytes())
+        return digest.hexdigest()
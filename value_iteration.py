@@ -0,0 +1,89 @@
+import numpy as np
+
+from energy_environment import EnergyEnvironment
+
+
+class ValueIterationPlanner:
+    def __init__(self, env, gamma=0.95, tolerance=1e-10, max_iterations=10000):
+        """
+        Solve the energy environment exactly with value iteration instead of sampled Q-learning.
+
+        The environment is deterministic and small, so its reward and transition tables (see
+        EnergyEnvironment.compile_tables) describe it completely.
+
+        Parameters:
+        - env: EnergyEnvironment to plan for. Its tables are compiled if it was not created with precompute=True.
+        - gamma: Discount factor, the same meaning as in QLearningAgent.
+        - tolerance: Stop once the largest change of a Q-value in one sweep is below this value.
+        - max_iterations: Upper bound on the number of sweeps.
+        """
+        if not env.precompute:
+            env.compile_tables()
+        self.env = env
+        self.gamma = gamma
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+        self.reward_table = env.reward_table
+        self.transition_table = env.transition_table
+        self.hourly_q_values = None
+        self.q_values = None
+        self.iterations = 0
+
+    @classmethod
+    def for_season(cls, num_rooms, season, **kwargs):
+        return cls(EnergyEnvironment(num_rooms=num_rooms, season=season, precompute=True), **kwargs)
+
+    def solve(self):
+        """
+        Run value iteration over (hour, state) and over state alone.
+
+        - hourly_q_values: (24, num_states, num_actions) optimal Q-values of a policy that knows the hour of day.
+          Its greedy policy is the optimal baseline for the environment.
+        - q_values: (num_states, num_actions) Q-values for the agent's observation, which has no clock. Each hour
+          is equally likely, so rewards are averaged over the day; this is the fixed point the agent's one-step
+          Q-learning rule converges to.
+
+        Returns:
+        - self, so calls can be chained.
+        """
+        hours = len(self.reward_table)
+        next_hour = np.roll(np.arange(hours), -1)
+
+        # Q[h, s, a] = R[h, a] + gamma * max_a' Q[h + 1, T[s, a], a']
+        hourly_q_values = np.zeros((hours,) + self.transition_table.shape)
+        for iteration in range(self.max_iterations):
+            values = hourly_q_values.max(axis=2)
+            updated = self.reward_table[:, None, :] + self.gamma * values[next_hour][:, self.transition_table]
+            change = np.abs(updated - hourly_q_values).max()
+            hourly_q_values = updated
+            if change < self.tolerance:
+                break
+        self.hourly_q_values = hourly_q_values
+        self.iterations = iteration + 1
+
+        # Q[s, a] = mean_h R[h, a] + gamma * max_a' Q[T[s, a], a']
+        mean_reward = self.reward_table.mean(axis=0)
+        q_values = np.zeros(self.transition_table.shape)
+        for iteration in range(self.max_iterations):
+            updated = mean_reward[None, :] + self.gamma * q_values.max(axis=1)[self.transition_table]
+            change = np.abs(updated - q_values).max()
+            q_values = updated
+            if change < self.tolerance:
+                break
+        self.q_values = q_values
+        return self
+
+    def hourly_policy(self):
+        """
+        Return the optimal action index for every (hour, state), shape (24, num_states).
+        """
+        return self.hourly_q_values.argmax(axis=2)
+
+    def apply_to(self, agent):
+        """
+        Replace the agent's Q-table with the solved one (converted to the agent's layout and storage), so
+        choose_action follows the planned policy.
+        """
+        agent.set_q_table(self.q_values.copy())
+        return agent
@@ -4,7 +4,7 @@ import numpy as np
 
 def generate_comparison_graphs(season, total_electricity_usage_trained, total_gas_usage_trained, total_cost_trained,
                                total_electricity_usage_random, total_gas_usage_random, total_cost_random,
-                               electricity_usage_abm, gas_usage_abm):
+                               electricity_usage_abm, gas_usage_abm, show=True):
     ## Trained Agent vs Random Policy
 
     # Create labels for the x-axis
@@ -60,7 +60,9 @@ def generate_comparison_graphs(season, total_electricity_usage_trained, total_ga
     # Save the graph
     plt.tight_layout()
     plt.savefig(f'visualisations/{season}_electricity_gas_cost_comparison_graph.png')
-    plt.show()
+    if show:
+        plt.show()
+    plt.close(fig)
 
     ## ABM vs Trained Agent vs Random Policy
 
@@ -85,7 +87,9 @@ def generate_comparison_graphs(season, total_electricity_usage_trained, total_ga
 
     fig.tight_layout()
     plt.savefig(f'visualisations/energy_usage_comparison_{season}.png')
-    plt.show()
+    if show:
+        plt.show()
+    plt.close(fig)
 
 
 